@@ -0,0 +1,325 @@
+# Requires Python 3
+from json_standardize import (
+    stream_transform_document,
+    transform_document,
+    profile_schema
+)
+from shared import (
+    generate_field_definitions,
+    readable_size,
+    IJSON_BACKEND,
+    JSON_BACKEND,
+    get_timestamp,
+    infer_schema,
+    get_logger,
+    read_json,
+    json_dump
+)
+import tracemalloc
+import contextlib
+import rapidjson
+import argparse
+import platform
+import tempfile
+import shutil
+import random
+import time
+import os
+
+
+logger = get_logger(__file__)
+
+# Synthetic corpora, every document nests `depth` levels of `children`
+# arrays of `fan_out` items, each item being a string with probability
+# `mixed_ratio` and an object otherwise
+CORPORA = [
+    {'name': 'shallow', 'depth': 2, 'fan_out': 4, 'mixed_ratio': 0.5,
+     'file_size': 64 * 1024, 'files': 50},
+    {'name': 'deep', 'depth': 8, 'fan_out': 2, 'mixed_ratio': 0.3,
+     'file_size': 256 * 1024, 'files': 20},
+    {'name': 'wide', 'depth': 3, 'fan_out': 16, 'mixed_ratio': 0.5,
+     'file_size': 256 * 1024, 'files': 20},
+    {'name': 'large', 'depth': 4, 'fan_out': 4, 'mixed_ratio': 0.5,
+     'file_size': 4 * 1024 * 1024, 'files': 4},
+]
+
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf',
+         'hotel', 'india', 'juliett', 'kilo', 'lima', 'mike', 'november']
+
+
+def make_node(rng, depth, fan_out, mixed_ratio):
+    node = {
+        'id': rng.randint(0, 1 << 30),
+        'name': ' '.join(rng.choice(WORDS) for _ in range(3)),
+    }
+    if depth > 0:
+        node['children'] = [
+            rng.choice(WORDS) if rng.random() < mixed_ratio else make_node(
+                rng, depth - 1, fan_out, mixed_ratio)
+            for _ in range(fan_out)]
+
+    return node
+
+
+def make_document(rng, depth, fan_out, mixed_ratio, file_size):
+    records, size = [], 0
+    while size < file_size:
+        record = make_node(rng, depth, fan_out, mixed_ratio)
+        size += len(rapidjson.dumps(record)) + 1
+        records.append(record)
+
+    return {'records': records}
+
+
+def generate_corpus(corpus_dir, depth, fan_out, mixed_ratio, file_size,
+                    files, seed=0, **kwargs):
+    """ Writes files synthetic documents, one per file on a single line,
+    and returns their paths
+
+    """
+    rng = random.Random(seed)
+    os.makedirs(corpus_dir, exist_ok=True)
+    fpaths = []
+    for idx in range(files):
+        fpath = os.path.join(corpus_dir, 'doc-{:05d}.json'.format(idx))
+        with open(fpath, 'w') as fp:
+            rapidjson.dump(make_document(
+                rng, depth, fan_out, mixed_ratio, file_size), fp)
+            fp.write('\n')
+        fpaths.append(fpath)
+
+    return fpaths
+
+
+def normalize_schema(schema):
+    """ Renames the array items of a schema inferred by a stock genson,
+    items, to the xitems the pipeline and its patched genson use
+
+    """
+    stack = [schema]
+    while stack:
+        node = stack.pop()
+        if 'items' in node and 'xitems' not in node:
+            node['xitems'] = node.pop('items')
+        if isinstance(node.get('xitems'), dict):
+            stack.append(node['xitems'])
+        stack.extend(node.get('properties', {}).values())
+        stack.extend(node.get('anyOf', []))
+
+    return schema
+
+
+class Stage:
+    """ Times a stage and reports its throughput over the bytes and
+    documents it went through, along with the peak of the memory it
+    allocated
+
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.bytes = 0
+        self.docs = 0
+        self.seconds = 0.0
+        self.peak_memory = 0
+
+    @contextlib.contextmanager
+    def measure(self, nbytes=0, docs=0):
+        start = time.perf_counter()
+        yield
+        self.seconds += time.perf_counter() - start
+        self.bytes += nbytes
+        self.docs += docs
+
+    @contextlib.contextmanager
+    def trace(self):
+        """ Records the peak of the memory allocated by the enclosed block,
+        to be run apart from the timed runs that tracemalloc slows down
+
+        """
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            self.peak_memory = max(
+                self.peak_memory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+    def result(self):
+        seconds = max(self.seconds, 1e-9)
+        result = {
+            'seconds': round(self.seconds, 6),
+            'bytes': self.bytes,
+            'docs': self.docs,
+            'mb_per_sec': round(self.bytes / seconds / 1024 / 1024, 3),
+            'docs_per_sec': round(self.docs / seconds, 3),
+            'peak_memory': self.peak_memory,
+        }
+        logger.debug('{}: {} docs in {:.3f} secs, {}, {:.1f} docs/s, '
+                     'peak memory {}'.format(
+                         self.name, self.docs, self.seconds,
+                         readable_size(result['mb_per_sec'] * 1024 * 1024,
+                                       is_speed=True),
+                         result['docs_per_sec'],
+                         readable_size(result['peak_memory'])))
+
+        return result
+
+
+def run_stage(name, run, units, repeat=1, reset=None):
+    """ Times run over every (argument, bytes, docs) unit repeat times,
+    then runs it once more over all of them under trace. reset, if given,
+    is called before every pass, e.g. to clear caches.
+
+    """
+    stage = Stage(name)
+    for _ in range(repeat):
+        if reset:
+            reset()
+        for argument, nbytes, docs in units:
+            with stage.measure(nbytes, docs):
+                run(argument)
+    if reset:
+        reset()
+    with stage.trace():
+        for argument, nbytes, docs in units:
+            run(argument)
+
+    return stage.result()
+
+
+def run_corpus(corpus, work_dir, repeat=1):
+    corpus_dir = os.path.join(work_dir, corpus['name'])
+    output_dir = os.path.join(work_dir, '{}_transformed'.format(
+        corpus['name']))
+    os.makedirs(output_dir, exist_ok=True)
+
+    logger.debug('Generating corpus {}...'.format(corpus['name']))
+    fpaths = generate_corpus(corpus_dir, **corpus)
+    sizes = {fpath: os.path.getsize(fpath) for fpath in fpaths}
+    corpus_size = sum(sizes.values())
+    file_units = [(fpath, sizes[fpath], 1) for fpath in fpaths]
+
+    def infer_corpus_schema(fpaths):
+        return normalize_schema(infer_schema(
+            read_json(fpath) for fpath in fpaths))
+
+    schema = infer_corpus_schema(fpaths)
+    all_transformation_prefixes = profile_schema(schema).mixed_prefixes
+    if not all_transformation_prefixes:
+        raise ValueError('Corpus {} has nothing to transform'.format(
+            corpus['name']))
+
+    def output_path(fpath):
+        return os.path.join(output_dir, os.path.basename(fpath))
+
+    def transform_file(fpath):
+        document = transform_document(fpath, all_transformation_prefixes)
+        if document is None:
+            raise ValueError('Failed to transform {}'.format(fpath))
+        with open(output_path(fpath), 'wb') as fd:
+            json_dump(document, fd)
+
+    def stream_transform_file(fpath):
+        if not stream_transform_document(
+                fpath, output_path(fpath), all_transformation_prefixes):
+            raise ValueError('Failed to transform {}'.format(fpath))
+
+    results = {
+        'infer_schema': run_stage(
+            'infer_schema', infer_corpus_schema,
+            [(fpaths, corpus_size, len(fpaths))]),
+        'generate_field_definitions': run_stage(
+            'generate_field_definitions',
+            lambda schema: generate_field_definitions(
+                schema['properties'], 0, set()),
+            [(schema, len(rapidjson.dumps(schema)), 1)], repeat),
+        'profile_schema': run_stage(
+            'profile_schema', profile_schema,
+            [(schema, len(rapidjson.dumps(schema)), 1)], repeat),
+        'transform_document': run_stage(
+            'transform_document', transform_file, file_units, repeat),
+        'stream_transform_document': run_stage(
+            'stream_transform_document', stream_transform_file,
+            file_units, repeat),
+    }
+
+    return {
+        'corpus': corpus,
+        'corpus_size': corpus_size,
+        'transformation_prefixes': len(all_transformation_prefixes),
+        'stages': results,
+    }
+
+
+def compare(results, baseline):
+    """ Logs the throughput change of every stage against a previous run
+
+    """
+    baseline_corpora = {run['corpus']['name']: run
+                        for run in baseline['corpora']}
+    for run in results['corpora']:
+        baseline_run = baseline_corpora.get(run['corpus']['name'])
+        if baseline_run is None:
+            continue
+        for name, stage in run['stages'].items():
+            baseline_stage = baseline_run['stages'].get(name)
+            if not baseline_stage or not baseline_stage['mb_per_sec']:
+                continue
+            logger.debug('{} {}: {:+.1f}% MB/s'.format(
+                run['corpus']['name'], name,
+                (stage['mb_per_sec'] / baseline_stage['mb_per_sec'] - 1) *
+                100))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmarks the json_standardize pipeline')
+    arg_parser.add_argument(
+        '-o', '--output', default='benchmark_results.json',
+        help='path of the results JSON file')
+    arg_parser.add_argument(
+        '-c', '--corpus', action='append',
+        choices=[corpus['name'] for corpus in CORPORA],
+        help='corpus to run, all of them by default')
+    arg_parser.add_argument(
+        '-r', '--repeat', type=int, default=1,
+        help='times the repeatable stages are run')
+    arg_parser.add_argument(
+        '-b', '--baseline',
+        help='results JSON file of a previous run to compare against')
+    arg_parser.add_argument(
+        '-w', '--work-dir',
+        help='directory the corpora are generated in, kept afterwards')
+    args = arg_parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='datalake_bench_')
+    corpora = [corpus for corpus in CORPORA
+               if not args.corpus or corpus['name'] in args.corpus]
+    results = {
+        'timestamp': get_timestamp(2),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'ijson_backend': IJSON_BACKEND,
+        'json_backend': JSON_BACKEND,
+        'corpora': [],
+    }
+
+    try:
+        for corpus in corpora:
+            results['corpora'].append(
+                run_corpus(corpus, work_dir, args.repeat))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w') as fp:
+        rapidjson.dump(results, fp, indent=2)
+    logger.debug('Benchmark results available at {}'.format(args.output))
+
+    if args.baseline:
+        compare(results, read_json(args.baseline))
+
+
+if __name__ == '__main__':
+    main()
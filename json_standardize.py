@@ -1,176 +1,458 @@
 from shared import (
+    get_date_partition_projection,
     generate_json_table_statement,
-    infer_schema_from_file,
+    infer_schema_from_files,
+    infer_schema_parallel,
+    TransformManifest,
+    SCHEMA_CACHE_DIR,
+    RollingJsonLinesWriter,
+    RollingParquetWriter,
+    get_partition_path,
+    get_date_partitions,
+    schema_to_arrow,
+    write_parquet,
+    is_valid_format,
+    delete_keys,
     get_s3_client,
+    arrow_row,
+    iter_archive,
+    S3Uploader,
     readable_time,
     dir_traverse,
+    DirScanner,
     ObjectDict,
+    mapped_files,
+    ijson_parse,
     get_logger,
-    read_json
+    iter_keys,
+    read_json,
+    json_dumps,
+    json_dump,
+    Profiler,
+    profiled,
+    Metrics
 )
-from math import ceil
+from concurrent.futures import ProcessPoolExecutor
+from json.encoder import encode_basestring_ascii
+from ijson.common import ObjectBuilder
+import collections
+import contextlib
 import functools
-import rapidjson
 import itertools
+import argparse
 import tempfile
+import datetime
+import hashlib
+import logging
 import ntpath
 import shutil
-import ijson
+import copy
 import time
-import sys
 import os
-import re
 import io
 
 
 logger = get_logger(__file__)
 
+metrics = Metrics()
 
-def get_sub_target_trail_end(sub_target_key):
-    sub_target_array = sub_target_key.split('.')
-    tot_items = sum([1 for i in sub_target_array if i == 'xitem'])
 
-    if not tot_items:
-        raise ValueError('No items found for {}'.format(sub_target_key))
+def schema_to_orig(prefix):
+    return prefix.replace(
+        'properties.', '').replace(
+        '.properties', '').replace(
+        '.type', '').replace('xitems', 'xitem')
 
-    if tot_items == 1:
-        return sub_target_key
 
-    sub_target_array.reverse()
-    item_occurences = [idx for idx, item in enumerate(
-        sub_target_array) if item == 'xitem']
+def _schema_node(prefix):
+    """Returns the schema node owning the type found at prefix, anyOf
+    branches being folded into the node they belong to
 
-    final_array = sub_target_array[item_occurences[0]:item_occurences[1]]
-    final_array.reverse()
+    """
+    keys = prefix.split('.')
+    node_keys = []
+    idx = 0
+    while idx < len(keys):
+        if keys[idx] == 'anyOf' and keys[idx + 1:idx + 2] == ['xitem']:
+            idx += 2
+            continue
+        node_keys.append(keys[idx])
+        idx += 1
 
-    return '.'.join(final_array)
+    if node_keys[-1:] == ['type']:
+        node_keys = node_keys[:-1]
+    elif node_keys[-2:] == ['type', 'xitem']:
+        node_keys = node_keys[:-2]
+    else:
+        return None
+    return '.'.join(node_keys)
 
 
-def target_finder(descriptor, target_key, target_type):
-    parser = ijson.parse(descriptor)
-    prefix_dict = dict()
-    ordered_keys = target_key.split('.')
-    target_prefix = '.'.join(ordered_keys[:-1])
-    sub_target_keys = ['.'.join(ordered_keys[:idx + 1]
-                                ) for idx, item in enumerate(
-        ordered_keys) if item == 'xitem']
+def profile_schema(schema_source):
+    """Profiles a schema in one pass over its ijson events
 
-    target_found = 0
-    for prefix, event, value in parser:
-        if event == 'start_array':
-            array_prefix = '{}.xitem'.format(prefix)
-            prefix_dict[array_prefix] = {'counter': None}
+    schema_source is a schema file path or an already loaded schema. Both
+    plain type lists and anyOf forms are understood, at any nesting,
+    including arrays within arrays. Returns an ObjectDict with:
 
-        if prefix in prefix_dict:
-            if event in ('null', 'string', 'start_map'):
-                if prefix_dict[prefix]['counter'] == None:
-                    prefix_dict[prefix]['counter'] = 0
-                else:
-                    prefix_dict[prefix]['counter'] += 1
-        if prefix == target_key and event == target_type:
-            try:
-                final_target_keys = [get_sub_target_trail_end(
-                    sub_target_key).replace('.xitem', '[{}]'.format(
-                        prefix_dict[sub_target_key][
-                            'counter'])) for sub_target_key in sub_target_keys]
-            except KeyError:
-                logger.debug(target_key)
-                raise
-            yield '.'.join(final_target_keys)
-
-
-def set_multilevel_attr_val(object_dict, attribute_tree, value=None):
-    attr_reg_expr = re.compile(r'^(\w+)(\[)(\d+)(\])$')
-    temp_dict = object_dict
-    attribute_tree_array = attribute_tree.split('.')
-    for node in attribute_tree_array[:-1]:
-        matches = re.findall(attr_reg_expr, node)
-        if not matches:
-            temp_dict = temp_dict.get(node)
-            continue
-        item = matches[0][0]
-        index = int(matches[0][2])
-        temp_list = temp_dict.get(item)
-        if isinstance(temp_list, list):
-            temp_dict = temp_list[index]
-        else:
-            raise IndexError('{} is not of type list'.format(item))
-    target_node = attribute_tree_array[-1]
-    matches = re.findall(attr_reg_expr, target_node)
-    if matches:
-        target_node = matches[0][0]
-        index = int(matches[0][2])
-        if isinstance(temp_dict[target_node][index],
-                      dict) and 'text' in temp_dict[
-                target_node][index] and isinstance(
-                temp_dict[target_node][index]['text'], list):
-            temp_dict[target_node][index]['text'].append(value['text'][0])
-        else:
-            temp_dict[target_node][index] = value
+    - mixed_prefixes: list of the '<node>.type' prefixes of nodes mixing
+      objects and strings, i.e. the transformation prefixes, in schema
+      order
+    - unions: dict of every node with more than one type to its types
+    - max_depth: deepest document path described by the schema
+
+    """
+    if isinstance(schema_source, dict):
+        descriptor = io.BytesIO(json_dumps(schema_source))
     else:
-        if isinstance(temp_dict[target_node],
-                      dict) and 'text' in temp_dict[
-                target_node] and isinstance(
-                temp_dict[target_node]['text'], list):
-            temp_dict[target_node]['text'].append(value['text'][0])
-        else:
-            temp_dict[target_node] = value
+        descriptor = open(schema_source, 'rb')
+
+    node_types = collections.OrderedDict()
+    with descriptor:
+        for prefix, event, value in ijson_parse(descriptor):
+            if event != 'string' or not (
+                    prefix == 'type' or prefix.endswith('.type') or
+                    prefix.endswith('.type.xitem')):
+                continue
+            node = _schema_node(prefix)
+            if node is not None:
+                node_types.setdefault(node, set()).add(value)
+
+    mixed_prefixes = []
+    unions = dict()
+    max_depth = 0
+    for node, types in node_types.items():
+        if len(types) > 1:
+            unions[node] = sorted(types)
+        if 'object' in types and 'string' in types:
+            mixed_prefixes.append(
+                '{}.type'.format(node) if node else 'type')
+        depth = len([key for key in schema_to_orig(node).split('.') if key])
+        max_depth = max(max_depth, depth)
+
+    return ObjectDict(
+        mixed_prefixes=mixed_prefixes,
+        unions=unions,
+        max_depth=max_depth)
+
+
+def get_transformation_possibilities(schema_source):
+    return profile_schema(schema_source).mixed_prefixes
+
+
+def standardize_schema(schema, all_transformation_prefixes):
+    """Returns a copy of schema describing the transformed documents,
+    where every string at a transformation prefix became an object
+    holding a ``text`` array of strings
+
+    """
+    schema = copy.deepcopy(schema)
+    for prefix in all_transformation_prefixes:
+        keys = prefix.split('.')
+        if keys[-1] == 'type':
+            keys = keys[:-1]
+        node = schema
+        for key in keys:
+            node = node.get(key) if isinstance(node, dict) else None
+        if not isinstance(node, dict):
+            continue
 
+        types = node.get('type')
+        types = types if isinstance(types, list) else [types]
+        types = [item for item in types if item != 'string']
+        if 'object' not in types:
+            types.append('object')
+        node['type'] = types[0] if len(types) == 1 else types
+        node.setdefault('properties', {})['text'] = {
+            'type': 'array', 'xitems': {'type': 'string'}}
+
+    return schema
+
+
+def get_target_prefixes(all_transformation_prefixes):
+    # Looked up for every string event, exact membership only
+    return frozenset(schema_to_orig(prefix)
+                     for prefix in all_transformation_prefixes)
+
+
+def get_transformation_fingerprint(all_transformation_prefixes,
+                                   bucket_name):
+    """Returns the fingerprint of what transformed files depend on besides
+    their source, for TransformManifest to tell outputs built for other
+    transformation prefixes or buckets
+
+    """
+    return hashlib.sha256(json_dumps(
+        [sorted(all_transformation_prefixes), bucket_name])).hexdigest()
+
+
+def _timed_events(descriptor, batch_size=1024):
+    """Yields the ijson events of descriptor, recording the time spent
+    parsing them under the parse metric and the time the caller spent on
+    them under rewrite
+
+    Events are parsed batch_size at a time so that the clock is only
+    read twice per batch rather than around every event. Close the
+    generator, e.g. with contextlib.closing, when stopping early.
+
+    """
+    events = ijson_parse(descriptor)
+    parse_time = rewrite_time = 0.0
+    parsed = None
+    try:
+        while True:
+            start = time.perf_counter()
+            if parsed is not None:
+                rewrite_time += start - parsed
+            batch = list(itertools.islice(events, batch_size))
+            parsed = time.perf_counter()
+            parse_time += parsed - start
+            if not batch:
+                parsed = None
+                return
+            yield from batch
+    finally:
+        if parsed is not None:
+            rewrite_time += time.perf_counter() - parsed
+        metrics.observe('parse', parse_time)
+        metrics.observe('rewrite', rewrite_time)
+
+
+def standardize_document(descriptor, target_prefixes):
+    """Builds the document from a single pass over its ijson events,
+    wrapping every string found under ``target_prefixes`` as
+    ``{'text': [...]}`` on the way
+
+    Returns the document along with the per prefix counts of strings
+    found and strings processed.
+
+    """
+    builder = ObjectBuilder()
+    strings_found = collections.Counter()
+    strings_processed = collections.Counter()
+    depth = 0
+
+    with contextlib.closing(_timed_events(descriptor)) as events:
+        for prefix, event, value in events:
+            if event == 'string' and prefix in target_prefixes:
+                strings_found[prefix] += 1
+                if value:
+                    builder.event('start_map', None)
+                    builder.event('map_key', 'text')
+                    builder.event('start_array', None)
+                    builder.event('string', value)
+                    builder.event('end_array', None)
+                    builder.event('end_map', None)
+                    strings_processed[prefix] += 1
+                    continue
+
+            builder.event(event, value)
+
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+            if not depth:
+                break
+
+    return builder.value, strings_found, strings_processed
+
+
+_JSON_LITERALS = {True: b'true', False: b'false', None: b'null'}
+
+
+def _encode_json_string(value):
+    return encode_basestring_ascii(value).encode('ascii')
+
+
+def _encode_json_scalar(event, value):
+    if event == 'string':
+        return _encode_json_string(value)
+    if event in ('boolean', 'null'):
+        return _JSON_LITERALS[value]
+    # ints, Decimals (non integer numbers) and floats all print as JSON
+    return repr(value).encode('ascii') if isinstance(
+        value, float) else str(value).encode('ascii')
+
+
+def stream_standardize_document(descriptor, target_prefixes, out_fp,
+                                flush_size=64 * 1024):
+    """Same as standardize_document, except that the document is written
+    to out_fp as JSON bytes while its events go by instead of being
+    built, so memory stays flat whatever the document size
+
+    Returns the per prefix counts of strings found and strings
+    processed.
+
+    """
+    strings_found = collections.Counter()
+    strings_processed = collections.Counter()
+    # [in a map, items so far] of every open container
+    containers = []
+    chunks, chunks_size = [], 0
+
+    with contextlib.closing(_timed_events(descriptor)) as events:
+        for prefix, event, value in events:
+            if event == 'map_key':
+                chunk = b'%s%s:' % (b',' if containers[-1][1] else b'',
+                                    _encode_json_string(value))
+                containers[-1][1] += 1
+            elif event in ('end_map', 'end_array'):
+                containers.pop()
+                chunk = b'}' if event == 'end_map' else b']'
+            else:
+                separator = b''
+                if containers and not containers[-1][0]:
+                    separator = b',' if containers[-1][1] else b''
+                    containers[-1][1] += 1
+                if event in ('start_map', 'start_array'):
+                    containers.append([event == 'start_map', 0])
+                    chunk = separator + (
+                        b'{' if event == 'start_map' else b'[')
+                elif event == 'string' and prefix in target_prefixes:
+                    strings_found[prefix] += 1
+                    if value:
+                        strings_processed[prefix] += 1
+                        chunk = b'%s{"text":[%s]}' % (
+                            separator, _encode_json_string(value))
+                    else:
+                        chunk = separator + _encode_json_string(value)
+                else:
+                    chunk = separator + _encode_json_scalar(event, value)
+
+            chunks.append(chunk)
+            chunks_size += len(chunk)
+            if chunks_size >= flush_size:
+                out_fp.write(b''.join(chunks))
+                chunks, chunks_size = [], 0
+            if not containers:
+                break
+
+    out_fp.write(b''.join(chunks))
+
+    return strings_found, strings_processed
+
+
+def stream_transform_document(fpath, fpath_transformed,
+                              all_transformation_prefixes):
+    """Streams the standardized document of fpath into fpath_transformed
+    with stream_standardize_document
+
+    Memory stays flat whatever the document size, which is why neither
+    compact nor Parquet output, both needing whole documents, can be
+    streamed. The output goes to a temporary file next to
+    fpath_transformed, renamed over it once every string was transformed
+    and removed otherwise. Returns whether the document was transformed.
+
+    """
+    target_prefixes = get_target_prefixes(all_transformation_prefixes)
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(fpath_transformed) or '.',
+        prefix='.{}.'.format(ntpath.basename(fpath_transformed)),
+        suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out_fp, mapped_files.reader(
+                fpath) as in_fp:
+            metrics.observe('file_in', len(in_fp.view), 'bytes')
+            strings_found, strings_processed = \
+                stream_standardize_document(in_fp, target_prefixes, out_fp)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    transformed = all_strings_processed(strings_found, strings_processed)
+
+    if not transformed:
+        os.remove(temp_path)
+        logger.debug('Transformation FAILED for: %s', fpath)
+        return False
+
+    os.replace(temp_path, fpath_transformed)
+    return True
+
+
+def get_s3_path(s3_base, fpath_transformed, partition_path=''):
+    return os.path.join(
+        s3_base, partition_path, ntpath.basename(fpath_transformed))
+
+
+def delete_stale_parts(s3_client, bucket_name, s3_prefix, part_prefix,
+                       part_keys):
+    """Deletes the parts left directly under s3_prefix by earlier runs
+    that part_keys, the parts of this run, did not overwrite
+
+    """
+    stale_keys = [key for key in iter_keys(
+        s3_client, bucket_name, s3_prefix, 1000, delimiter='/')
+        if ntpath.basename(key).startswith('{}-'.format(part_prefix)) and
+        key not in part_keys]
+    if stale_keys:
+        logger.debug('Deleting %s stale parts under %s',
+                     len(stale_keys), s3_prefix)
+        delete_keys(s3_client, bucket_name, stale_keys)
+
+
+def all_strings_processed(strings_found, strings_processed):
+    transformed = True
+    for target_prefix, tot_strings in strings_found.items():
+        total_strings_processed = strings_processed[target_prefix]
+        if tot_strings != total_strings_processed:
+            transformed = False
+            logger.debug(
+                '%s ** FAILED ** - Strings - Reported: %s,'
+                ' Found: %s, Processed: %s',
+                target_prefix,
+                tot_strings,
+                tot_strings,
+                total_strings_processed)
 
-def get_multilevel_attr_val(object_dict, attribute_tree):
-    return functools.reduce(
-        lambda x, y: getattr(x, y, ''), attribute_tree.split('.'),
-        object_dict)
+    return transformed
 
 
-def schema_to_orig(prefix):
-    return prefix.replace(
-        'properties.', '').replace(
-        '.properties', '').replace(
-        '.type', '').replace('xitems', 'xitem')
+def transform_document(fpath, all_transformation_prefixes):
+    """Returns the standardized document of fpath, or None when some of
+    its strings could not be transformed
 
+    fpath may also be a binary file object, such as an archive member
+    from iter_archive, which is read from its current position.
 
-def get_transformation_possibilities(filename):
-    transformation_required_prefixes = []
-    properties_id = 0
-
-    with open(filename, 'rb') as fd:
-        parser = ijson.parse(fd)
-        running_prefix, found_object, found_string = None, False, False
-        for prefix, event, value in parser:
-            if running_prefix:
-                if prefix == '{}.xitem'.format(running_prefix
-                                               ) and value == 'object':
-                    found_object = True
-                elif prefix == '{}.xitem'.format(running_prefix
-                                                 ) and value == 'string':
-                    found_string = True
-                if event == 'end_array':
-                    if found_object and found_string:
-                        transformation_required_prefixes.append(running_prefix)
-                    (running_prefix, found_object, found_string) = (
-                        None, False, False)
-                continue
-            if event == 'start_array' and prefix.endswith('type'):
-                running_prefix = prefix
+    """
+    target_prefixes = get_target_prefixes(all_transformation_prefixes)
 
-    return transformation_required_prefixes
+    descriptor = contextlib.nullcontext(fpath) if hasattr(
+        fpath, 'read') else mapped_files.reader(fpath)
+    with descriptor as fd:
+        if fd is not fpath:
+            metrics.observe('file_in', len(fd.view), 'bytes')
+        orig_json_object, strings_found, strings_processed = \
+            standardize_document(fd, target_prefixes)
 
+    transformed = all_strings_processed(strings_found, strings_processed)
 
-def get_applicable_transformation_prefixes(
-        filepath,
-        all_transformation_prefixes):
-    schema = infer_schema_from_file(filepath)
-    schema_descriptor = io.StringIO(rapidjson.dumps(schema))
+    if transformed:
+        return orig_json_object
 
-    parser = ijson.parse(schema_descriptor)
-    available_prefixes = set([
-        prefix for prefix, event, value in parser])
+    logger.debug('Transformation FAILED for: %s',
+                 getattr(fpath, 'name', fpath))
+    return None
 
-    applicable_transformation_prefixes = available_prefixes.intersection(
-        set(all_transformation_prefixes))
 
-    return list(applicable_transformation_prefixes)
+def transform_archive(archive_path, all_transformation_prefixes,
+                      workers=None):
+    """Yields (member_name, document) for every JSON document found in
+    an archive, nested ones included, streaming members straight out of
+    it instead of extracting them first
+
+    document is None when it could not be transformed. See iter_archive
+    for the archive formats and workers.
+
+    """
+    for member_name, member in iter_archive(archive_path, workers=workers):
+        if not is_valid_format(member, 'json'):
+            logger.debug('Skipping non JSON member %s', member_name)
+            continue
+        yield member_name, transform_document(
+            member, all_transformation_prefixes)
 
 
 def _transform(
@@ -180,95 +462,148 @@ def _transform(
         s3_client,
         bucket_name,
         s3_base,
-        upload=False):
-    with open(fpath, 'rb') as fd:
-        orig_json_object = ObjectDict(next(ijson.items(fd, '')))
-
-    transformed = True
-    applicable_transformation_prefixes = \
-        get_applicable_transformation_prefixes(
-            fpath,
-            all_transformation_prefixes)
-
-    for applicable_transformation_prefix in \
-            applicable_transformation_prefixes:
-
-        applicable_transformation_prefix = schema_to_orig(
-            applicable_transformation_prefix)
-
-        with open(fpath, 'rb') as fp:
-            total_items = list(ijson.items(
-                fp, applicable_transformation_prefix))
-            tot_strings = sum([1 for item in total_items if isinstance(
-                item, str)])
-
-        if tot_strings:
-            total_strings_processed = 0
-            with open(fpath, 'rb') as fp:
-                for strings_found_count, \
-                        current_applicable_transformation_prefix \
-                        in enumerate(target_finder(
-                            fp,
-                            applicable_transformation_prefix,
-                            'string')):
-                    try:
-                        current_applicable_transformation_value = \
-                            get_multilevel_attr_val(
-                                orig_json_object,
-                                current_applicable_transformation_prefix)
-                    except IndexError:
-                        logger.debug(
-                            'Failed to find the index {}'.format(
-                                current_applicable_transformation_prefix))
-                    else:
-                        if isinstance(
-                                current_applicable_transformation_value,
-                                str) and \
-                                current_applicable_transformation_value:
-                            replaced_value = \
-                                {'text':
-                                 [current_applicable_transformation_value]
-                                 }
-                            set_multilevel_attr_val(
-                                orig_json_object,
-                                current_applicable_transformation_prefix,
-                                replaced_value
-                            )
-                            total_strings_processed += 1
-                strings_found_count += 1
-                if strings_found_count == tot_strings ==\
-                        total_strings_processed:
-                    pass
-                else:
-                    transformed = False
-                    logger.debug(
-                        '{} ** FAILED ** - Strings - Reported: {},'
-                        ' Found: {}, Processed: {}'.format(
-                            applicable_transformation_prefix,
-                            tot_strings,
-                            strings_found_count,
-                            total_strings_processed))
-
-    if transformed:
-        with open(fpath_transformed, 'wb') as fd:
-            rapidjson.dump(orig_json_object, fd)
-        logger.debug(
-            'Transformation SUCCESS. Transformed '
-            'JSON written to {}'.format(fpath_transformed))
-        if upload:
-            file_base = ntpath.basename(fpath_transformed)
-            s3_path = os.path.join(s3_base, file_base)
+        upload=False,
+        arrow_schema=None,
+        streaming=False):
+    """Transforms fpath into fpath_transformed, as Parquet with an
+    arrow_schema and as JSON otherwise, then optionally uploads it
+
+    With streaming, JSON is written while fpath is parsed instead of
+    building the document first, see stream_transform_document.
+
+    """
+    if streaming and arrow_schema is not None:
+        raise ValueError('streaming only supports JSON output')
+
+    if streaming:
+        if not stream_transform_document(
+                fpath, fpath_transformed, all_transformation_prefixes):
+            return False
+    else:
+        orig_json_object = transform_document(
+            fpath, all_transformation_prefixes)
+        if orig_json_object is None:
+            return False
+
+        with metrics.timer('serialize'):
+            if arrow_schema is not None:
+                write_parquet(
+                    [orig_json_object], fpath_transformed, arrow_schema)
+            else:
+                with open(fpath_transformed, 'wb') as fd:
+                    json_dump(orig_json_object, fd)
+    metrics.observe(
+        'file_out', os.path.getsize(fpath_transformed), 'bytes')
+    logger.debug(
+        'Transformation SUCCESS. Transformed '
+        'JSON written to %s', fpath_transformed)
+    if upload:
+        s3_path = get_s3_path(s3_base, fpath_transformed)
+        with metrics.timer('upload'):
             s3_client.upload_file(
                 fpath_transformed,
                 bucket_name,
                 s3_path)
-            logger.debug('Transformed JSON {} uploaded to {}'.format(
-                fpath_transformed, s3_path))
-        return True
-
-    logger.debug(
-        'Transformation FAILED for: {}'.format(fpath))
-    return False
+        logger.debug('Transformed JSON %s uploaded to %s',
+                     fpath_transformed, s3_path)
+    return True
+
+
+_worker_state = dict()
+
+
+class _RecordCollector(logging.Handler):
+    """Holds on to the log records of a worker so that the parent can
+    replay them in file order
+
+    """
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        self.records.append(record)
+
+
+def _init_transform_worker(all_transformation_prefixes, arrow_schema=None,
+                           compact=False, profiler=None, streaming=False):
+    """Hands a worker process its transformation state once, at start up,
+    rather than along with every file. Its log records are collected for
+    the parent to replay in file order.
+
+    """
+    collector = _RecordCollector()
+    logger.handlers = [collector]
+    logger.propagate = False
+    # Forked workers inherit the samples the parent recorded so far
+    metrics.reset()
+
+    _worker_state.update(
+        all_transformation_prefixes=all_transformation_prefixes,
+        arrow_schema=arrow_schema,
+        compact=compact,
+        profiler=profiler,
+        streaming=streaming,
+        collector=collector)
+
+
+def _transform_worker(paths):
+    collector = _worker_state['collector']
+    collector.records = []
+
+    transformed, line, _, _ = _transform_logged(
+        paths,
+        _worker_state['all_transformation_prefixes'],
+        _worker_state['arrow_schema'],
+        _worker_state['compact'],
+        _worker_state['profiler'],
+        _worker_state['streaming'])
+
+    return (transformed, line, collector.records,
+            metrics.snapshot(reset=True))
+
+
+def _transform_logged(paths, all_transformation_prefixes, arrow_schema=None,
+                      compact=False, profiler=None, streaming=False):
+    """Transforms one file, returning the serialised document, or its
+    Parquet row with an arrow_schema, instead of writing it when compacting
+
+    Returns (transformed, line, log records, metrics snapshot), records
+    and snapshot being only filled in by _transform_worker. Files sampled
+    by profiler are profiled on their own.
+
+    """
+    fpath, fpath_transformed = paths
+    if profiler:
+        with profiler.sample(fpath):
+            return _transform_logged(
+                paths, all_transformation_prefixes, arrow_schema, compact,
+                streaming=streaming)
+    logger.debug('Running applicable transformation logic for %s', fpath)
+
+    if compact:
+        orig_json_object = transform_document(
+            fpath, all_transformation_prefixes)
+        if orig_json_object is None:
+            return False, None, [], None
+        with metrics.timer('serialize'):
+            if arrow_schema is not None:
+                return True, arrow_row(
+                    orig_json_object, arrow_schema), [], None
+            line = json_dumps(orig_json_object)
+        metrics.observe('file_out', len(line), 'bytes')
+        return True, line, [], None
+
+    transformed = _transform(
+        fpath, fpath_transformed,
+        all_transformation_prefixes, None, None, None,
+        arrow_schema=arrow_schema,
+        streaming=streaming)
+
+    return transformed, None, [], None
 
 
 def transform(
@@ -277,49 +612,249 @@ def transform(
         source_schema_path,
         s3_client,
         bucket_name,
-        s3_base):
-    success, failed = 0, 0
-
-    transform_start = time.time()
-
-    all_transformation_prefixes = get_transformation_possibilities(
-        source_schema_path)
-
-    if os.path.exists(dest_dir):
-        shutil.rmtree(dest_dir)
-    os.makedirs(dest_dir)
-
-    for idx, fpath in enumerate(dir_traverse(source_dir)):
-        logger.debug('Running applicable transformation logic for {}'.format(
-            fpath))
-        fpath_transformed = os.path.join(
-            dest_dir, ntpath.basename(fpath))
-        transformed = _transform(
-            fpath, fpath_transformed,
-            all_transformation_prefixes, s3_client,
-            bucket_name, s3_base, True)
-        if transformed:
-            success += 1
+        s3_base,
+        workers=None,
+        incremental=False,
+        manifest_path=None,
+        upload_workers=8,
+        upload_queue_size=64,
+        output_format='json',
+        compact=False,
+        max_file_size=128 * 1024 * 1024,
+        max_records=None,
+        compression=None,
+        partitions=None,
+        metrics_path=None,
+        profile=None,
+        profile_every=None,
+        streaming=False):
+    """Transforms every file in source_dir into dest_dir and uploads the
+    results to s3_base
+
+    - workers: processes transforming files, this one only without
+    - upload_workers, upload_queue_size: see S3Uploader, files whose
+      upload failed are failed and raise a RuntimeError once done
+    - incremental, manifest_path: skips the files recorded as unchanged
+      in the manifest, <dest_dir>.manifest.sqlite by default
+    - output_format: 'json' or 'parquet', Parquet being always compact
+    - compact, max_file_size, max_records, compression: batches documents
+      into rolling part files, see RollingJsonLinesWriter
+    - partitions: Hive partition (key, value) pairs, see
+      get_date_partitions
+    - metrics_path: where the metrics recorded since the last
+      metrics.reset(), e.g. by main() along with schema inference, are
+      dumped, see Metrics.dump
+    - profile, profile_every: see Profiler
+    - streaming: rewrites JSON documents as they are parsed, see
+      stream_transform_document
+
+    """
+    compact = compact or output_format == 'parquet'
+    if compact and incremental:
+        raise ValueError(
+            'compact and parquet output do not support incremental')
+    if streaming and (compact or output_format != 'json'):
+        raise ValueError(
+            'streaming only supports non compact JSON output')
+
+    # Profiles the whole run, or with profile_every a sample of its files
+    profiler = Profiler(
+        'transform', '{}.profile'.format(dest_dir.rstrip(os.sep)),
+        modes=profile, every=profile_every)
+    with profiler.run():
+        success, failed, skipped = 0, 0, 0
+
+        transform_start = time.time()
+
+        with metrics.timer('schema_profile'):
+            schema_profile = profile_schema(source_schema_path)
+        all_transformation_prefixes = schema_profile.mixed_prefixes
+        logger.debug(
+            'Schema profile - Transformation prefixes: {}, Unions: {},'
+            ' Max depth: {}'.format(
+                len(all_transformation_prefixes),
+                len(schema_profile.unions),
+                schema_profile.max_depth))
+
+        arrow_schema = None
+        if output_format == 'parquet':
+            source_schema = source_schema_path if isinstance(
+                source_schema_path, dict) else read_json(source_schema_path)
+            arrow_schema = schema_to_arrow(standardize_schema(
+                source_schema, all_transformation_prefixes))
+
+        partition_path = get_partition_path(partitions or [])
+        output_dir = os.path.join(dest_dir, partition_path)
+
+        manifest = fingerprint = None
+        if incremental:
+            manifest = TransformManifest(
+                manifest_path or '{}.manifest.sqlite'.format(
+                    dest_dir.rstrip(os.sep)))
+            fingerprint = get_transformation_fingerprint(
+                all_transformation_prefixes, bucket_name)
+            os.makedirs(output_dir, exist_ok=True)
         else:
-            failed += 1
-
-    logger.debug('Success: {}'.format(success))
-    logger.debug('Failed: {}'.format(failed))
-
-    transform_end = time.time()
-
-    total_time = readable_time(transform_end - transform_start)
-    logger.debug('total time: {}'.format(total_time))
-
-
-def generate_schema(source_dir, schema_path):
-    sys.setrecursionlimit(1600)
-    json_objects = [read_json(fpath) for fpath in dir_traverse(source_dir)]
+            if os.path.exists(dest_dir):
+                shutil.rmtree(dest_dir)
+            os.makedirs(output_dir)
+
+        all_paths = []
+        for entry in DirScanner(source_dir):
+            fpath = entry.path
+            fpath_transformed = os.path.join(
+                output_dir, ntpath.basename(fpath))
+            if manifest and manifest.is_unchanged(
+                    fpath, entry.stat(), fingerprint,
+                    get_s3_path(s3_base, fpath_transformed, partition_path)):
+                skipped += 1
+                continue
+            all_paths.append((fpath, fpath_transformed))
+
+        profiler.select([fpath for fpath, _ in all_paths])
+
+        executor = None
+        if workers and workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_transform_worker,
+                initargs=(all_transformation_prefixes, arrow_schema, compact,
+                          profiler, streaming))
+            results = executor.map(_transform_worker, all_paths, chunksize=16)
+        else:
+            results = (_transform_logged(
+                paths, all_transformation_prefixes, arrow_schema, compact,
+                profiler, streaming) for paths in all_paths)
+
+        uploader = S3Uploader(
+            bucket_name,
+            s3_client=s3_client,
+            max_workers=upload_workers,
+            max_queue_size=upload_queue_size,
+            metrics=metrics)
+        # Sources of every part, so that failed part uploads fail their files
+        part_sources = dict()
+        part_keys = set()
+
+        def upload_part(part_path, sources):
+            part_sources[part_path] = sources
+            part_key = get_s3_path(s3_base, part_path, partition_path)
+            part_keys.add(part_key)
+            uploader.submit(part_path, part_key)
+
+        writer = None
+        if arrow_schema is not None:
+            writer = RollingParquetWriter(
+                output_dir,
+                arrow_schema,
+                max_bytes=max_file_size,
+                max_records=max_records,
+                compression=compression,
+                on_close=upload_part)
+        elif compact:
+            writer = RollingJsonLinesWriter(
+                output_dir,
+                max_bytes=max_file_size,
+                max_records=max_records,
+                compression=compression,
+                on_close=upload_part)
+        try:
+            for (fpath, fpath_transformed), (
+                    transformed, line, records, snapshot) in zip(
+                    all_paths, results):
+                for record in records:
+                    logger.handle(record)
+                if snapshot:
+                    metrics.merge(snapshot)
+                if not transformed:
+                    failed += 1
+                    continue
+                success += 1
+                if writer:
+                    writer.write(line, fpath)
+                    continue
+                callback = functools.partial(
+                    manifest.record, fpath,
+                    fingerprint=fingerprint) if manifest else None
+                uploader.submit(
+                    fpath_transformed,
+                    get_s3_path(s3_base, fpath_transformed, partition_path),
+                    callback)
+        finally:
+            if executor:
+                executor.shutdown()
+            if writer:
+                writer.close()
+            uploader.close()
+            if manifest:
+                manifest.close()
+            mapped_files.close()
+
+        # Parts of earlier runs go only once this run replaced all of them
+        if writer and part_keys and not failed and not uploader.failures:
+            delete_stale_parts(
+                uploader.s3_client, bucket_name,
+                get_s3_path(s3_base, '', partition_path), writer.prefix,
+                part_keys)
+
+        upload_failed = sum(len(part_sources.get(fpath, [fpath]))
+                            for fpath, _, _ in uploader.failures)
+        success -= upload_failed
+        failed += upload_failed
+
+        logger.debug('Success: {}'.format(success))
+        logger.debug('Failed: {}'.format(failed))
+        if incremental:
+            logger.debug('Skipped (unchanged): {}'.format(skipped))
+
+        metrics.incr('transformed', success)
+        metrics.incr('failed', failed)
+        metrics.incr('skipped', skipped)
+        metrics.log_summary(logger)
+        if metrics_path:
+            metrics.dump(metrics_path)
+            logger.debug('Metrics available at {}'.format(metrics_path))
+
+        transform_end = time.time()
+
+        total_time = readable_time(transform_end - transform_start)
+        logger.debug('total time: {}'.format(total_time))
+
+        uploader.raise_for_failures()
+
+
+@profiled('generate_schema', lambda arguments: os.path.dirname(
+    os.path.abspath(arguments['schema_path'])))
+def generate_schema(source_dir, schema_path, workers=None,
+                    cache_dir=SCHEMA_CACHE_DIR, profile=None):
     logger.debug('Inferring schema from files in {}...'.format(source_dir))
-    return infer_schema(json_objects)
+    with metrics.timer('schema_inference'):
+        if workers and workers > 1:
+            return infer_schema_parallel(
+                dir_traverse(source_dir), workers, cache_dir=cache_dir)
+        return infer_schema_from_files(dir_traverse(source_dir), cache_dir)
 
 
 def main():
+    # One run, from schema inference to upload, per set of metrics
+    metrics.reset()
+
+    arg_parser = argparse.ArgumentParser(
+        description='Transforms the deltacon_athena documents and uploads '
+                    'them to S3')
+    arg_parser.add_argument(
+        '-d', '--date', default=datetime.date.today().isoformat(),
+        type=lambda value: datetime.datetime.strptime(
+            value, '%Y-%m-%d').date(),
+        help='YYYY-MM-DD date partition of the run, today by default')
+    arg_parser.add_argument(
+        '--first-year', type=int,
+        default=os.getenv('DATALAKE_PARTITION_FIRST_YEAR'),
+        help='first year of the table partition projection, '
+             'DATALAKE_PARTITION_FIRST_YEAR or the year of --date by '
+             'default')
+    args = arg_parser.parse_args()
+
     root_dir = os.path.expanduser('~')
     data_dir = os.path.join(root_dir, 'data', 'who')
     source_dir = os.path.join(data_dir, 'deltacon_athena')
@@ -331,23 +866,33 @@ def main():
         data_dir, 'deltacon_athena_schema_transformed.json')
     sql_statement_path = os.path.join(
         data_dir, 'deltacon_athena_schema_transformed.sql')
-    s3_client = get_s3_client()
-    s3_base = 'data/2018/05/09/structured/processed/'\
-        'who/deltacon_athena_transformed'
+    s3_client = get_s3_client(max_pool_connections=32)
+    s3_base = 'data/structured/processed/deltacon_athena_transformed'
     bucket_name = 'nexscope-safety'
+    partitions = get_date_partitions('who', args.date)
+    partition_projection = [
+        ('source', {'type': 'enum', 'values': 'who'})
+    ] + get_date_partition_projection(args.first_year or args.date.year)
 
-    schema = generate_schema(source_dir, source_schema_path)
+    # Both schema passes read source_dir, the second one from the cache
+    with tempfile.TemporaryDirectory(prefix='schema_cache_') as cache_dir:
+        cache_dir = SCHEMA_CACHE_DIR or cache_dir
+        schema = generate_schema(
+            source_dir, source_schema_path, cache_dir=cache_dir)
 
-    transform(source_dir,
-              dest_dir,
-              schema, s3_client, bucket_name, s3_base)
+        transform(source_dir,
+                  dest_dir,
+                  schema, s3_client, bucket_name, s3_base,
+                  partitions=partitions)
 
-    schema = generate_schema(source_dir, dest_schema_path)
+        schema = generate_schema(
+            source_dir, dest_schema_path, cache_dir=cache_dir)
 
     hive_sql_statement = generate_json_table_statement(
         'test', schema,
-        data_location='s3://safety',
-        database='safety')
+        data_location='s3://{}/{}/'.format(bucket_name, s3_base),
+        database='safety',
+        partitions=partition_projection)
 
     with open(sql_statement_path, 'w') as fp:
         fp.write(hive_sql_statement)
@@ -1,46 +1,207 @@
 # Requires Python 3
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from shared import get_logger
 from io import StringIO
-import tempfile
+import datetime
 import requests
 import csv
-import re
 import os
+import re
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+
+logger = get_logger(__file__)
+
+CFTC_BASE_URL = 'https://www.cftc.gov'
+
+# Exchange codes as used in the CFTC report file names
+EXCHANGES = {
+    'cbt': 'Chicago Board of Trade',
+    'cme': 'Chicago Mercantile Exchange',
+    'cmx': 'Commodity Exchange (COMEX)',
+    'nyme': 'New York Mercantile Exchange',
+    'nybt': 'ICE Futures U.S.',
+}
+
+CURRENT_REPORT_PATH = '/dea/futures/dea{exchange}sf.htm'
+ARCHIVE_REPORT_PATH = '/sites/default/files/files/dea/cotarchives/' \
+    '{date:%Y}/futures/dea{exchange}sf{date:%m%d%y}.htm'
+
+# A contract line ends with its CFTC code, the open interest of that
+# contract follows a few lines below it
+OPEN_INTEREST_REG_EXPR = re.compile(
+    r'^(?:(?P<contract>.+)Code-\w+'
+    r'|.+OPEN INTEREST:\s+(?P<open_interest>[0-9,]+))$')
+
+
+def iter_lines(download_url, session=None):
+    """ Streams the lines of a report without holding the whole response
+
+    """
+    resp = (session or requests).get(download_url, stream=True)
+    with resp:
+        resp.raise_for_status()
+        resp.encoding = resp.encoding or 'utf-8'
+        for line in resp.iter_lines(decode_unicode=True):
+            yield line
+
+
+def iter_rows(lines):
+    """ Yields (contract, open_interest) rows matching both patterns in a
+    single pass over the lines
+
+    """
+    contract, open_interest = None, None
+    for line in lines:
+        match = OPEN_INTEREST_REG_EXPR.match(line)
+        if not match:
+            continue
+
+        if match.group('contract') is not None:
+            contract = match.group('contract').strip()
+        else:
+            open_interest = match.group('open_interest').replace(',', '')
+
+        if contract and open_interest:
+            yield contract, open_interest
+            contract, open_interest = None, None
+
+
+def parse_to_frame(download_url, session=None):
+    """ Returns the report as a pandas DataFrame with an integer
+    open_interest column
+
+    """
+    if pandas is None:
+        raise ImportError('pandas is required for columnar output')
 
+    frame = pandas.DataFrame.from_records(
+        iter_rows(iter_lines(download_url, session)),
+        columns=['contract', 'open_interest'])
+    frame['open_interest'] = frame['open_interest'].astype('int64')
 
-def parser(download_url):
-    compilation1 = re.compile(
-        r'^(.+)(Code-\w+)$')
-    compilation2 = re.compile(
-        r'^(.+)(OPEN INTEREST:\s+)([0-9,]+)$')
+    return frame
 
-    fid, fname = tempfile.mkstemp()
-    with open(fname, 'w') as f:
-        resp = requests.get(download_url)
-        f.write(resp.text)
 
+def parser(download_url, session=None):
     csv_stream = StringIO()
     csv_writer = csv.writer(csv_stream, delimiter=',')
     csv_writer.writerow(['contract', 'open_interest'])
+    csv_writer.writerows(iter_rows(iter_lines(download_url, session)))
 
-    with open(fname) as f:
-        contract, open_interest = None, None
-        for line in f.readlines():
-            matches1 = re.findall(compilation1, line)
-            matches2 = re.findall(compilation2, line)
+    return csv_stream.getvalue()
 
-            if matches1 and len(matches1[0]) == 2:
-                contract = matches1[0][0].strip()
-            elif matches2 and len(matches2[0]) == 3:
-                open_interest = matches2[0][2].strip(
-                ).replace(',', '')
 
-            if contract and open_interest:
-                csv_writer.writerow([contract, open_interest])
-                contract, open_interest = None, None
+def report_dates(start_date, end_date, weekday=1):
+    """ Yields the weekly report dates, Tuesdays by default, between
+    start_date and end_date inclusive
 
-    os.remove(fname)
+    """
+    current = start_date + datetime.timedelta(
+        days=(weekday - start_date.weekday()) % 7)
+    while current <= end_date:
+        yield current
+        current += datetime.timedelta(days=7)
 
-    return csv_stream.getvalue()
+
+def report_urls(exchanges=None, dates=None, base_url=CFTC_BASE_URL):
+    """ Yields (exchange, report_date, url) for the current report of each
+    exchange, or for its archived report on each of the given dates
+
+    """
+    for exchange in exchanges or EXCHANGES:
+        if not dates:
+            yield exchange, None, base_url + CURRENT_REPORT_PATH.format(
+                exchange=exchange)
+            continue
+        for report_date in dates:
+            yield exchange, report_date, '{}{}'.format(
+                base_url, ARCHIVE_REPORT_PATH.format(
+                    exchange=exchange, date=report_date))
+
+
+def get_session(pool_size=8, retries=3):
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(
+            total=retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504)))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+def _fetch_report(report, session):
+    exchange, report_date, download_url = report
+    try:
+        rows = list(iter_rows(iter_lines(download_url, session)))
+    except requests.RequestException as error:
+        logger.debug('Failed to fetch {}: {}'.format(download_url, error))
+        return report, None
+
+    return report, rows
+
+
+def _write_partition(output_dir, exchange, report_date, rows, output_format):
+    partition_dir = os.path.join(
+        output_dir,
+        'exchange={}'.format(exchange),
+        'report_date={}'.format(
+            report_date.isoformat() if report_date else 'latest'))
+    os.makedirs(partition_dir, exist_ok=True)
+
+    if output_format == 'parquet':
+        if pandas is None:
+            raise ImportError('pandas is required for parquet output')
+        output_path = os.path.join(partition_dir, 'part-0.parquet')
+        frame = pandas.DataFrame.from_records(
+            rows, columns=['contract', 'open_interest'])
+        frame['open_interest'] = frame['open_interest'].astype('int64')
+        frame.to_parquet(output_path, index=False)
+    else:
+        output_path = os.path.join(partition_dir, 'part-0.csv')
+        with open(output_path, 'w', newline='') as fp:
+            csv_writer = csv.writer(fp, delimiter=',')
+            csv_writer.writerow(['contract', 'open_interest'])
+            csv_writer.writerows(rows)
+
+    return output_path
+
+
+def ingest(reports, output_dir, workers=8, output_format='csv',
+           session=None):
+    """ Fetches and parses reports concurrently over a pooled session and
+    writes them as one dataset partitioned by exchange and report date
+
+    reports are (exchange, report_date, url) tuples as yielded by
+    report_urls. Reports that can not be fetched, e.g. archive dates
+    without a report, are logged and skipped. Returns the written paths.
+
+    """
+    session = session or get_session(workers)
+    output_paths = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for (exchange, report_date, download_url), rows in executor.map(
+                lambda report: _fetch_report(report, session), reports):
+            if rows is None:
+                continue
+            output_paths.append(_write_partition(
+                output_dir, exchange, report_date, rows, output_format))
+            logger.debug('Parsed %s contracts from %s',
+                         len(rows), download_url)
+
+    return output_paths
 
 
 def main():
@@ -1,42 +1,141 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import wait, FIRST_COMPLETED
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
 from boto3.session import Session
 from functools import wraps
-from itertools import chain
+from itertools import islice
+from decimal import Decimal
+import tracemalloc
+import importlib
+import collections
+import contextlib
 import rapidjson
+import functools
+import threading
 import datetime
+import tempfile
+import cProfile
+import inspect
+import hashlib
+import atexit
+import sqlite3
+import logging.handlers
 import logging
 import zipfile
+import mmap
+import tarfile
 import pathlib
 import shutil
 import ntpath
 import genson
-import numpy
+import ijson
+import random
+import heapq
+import math
+import queue
 import uuid
+import json
 import time
 import gzip
 import sys
 import re
 import os
+import io
 
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
-def get_logger(filename, log_file=None):
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_queued_loggers = []
+
+
+def _stop_log_listeners():
+    for xlogger, queue_handler, channel, listener in _queued_loggers:
+        listener.stop()
+
+
+def _unqueue_loggers():
+    # Listener threads do not survive a fork, forked children log
+    # straight to the underlying handlers instead
+    for xlogger, queue_handler, channel, listener in _queued_loggers:
+        xlogger.removeHandler(queue_handler)
+        xlogger.addHandler(channel)
+    del _queued_loggers[:]
+
+
+def get_logger(filename, log_file=None, level=None, queued=None):
+    """ Returns the logger of filename, configured on first use only
+
+    level, a name in any case or a number, defaults to
+    DATALAKE_LOG_LEVEL, DEBUG if unset. With queued, or
+    DATALAKE_LOG_QUEUE=1, records are handed to a QueueListener and
+    written on its background thread, keeping log I/O off hot loops.
+    Their message is merged with its arguments beforehand, as the
+    arguments may change once the call returns. Pending records are
+    flushed at exit.
+
+    """
     xlogger = logging.getLogger(filename)
-    xlogger.setLevel(logging.DEBUG)
+    if xlogger.handlers:
+        return xlogger
+
+    level = level or os.getenv('DATALAKE_LOG_LEVEL', 'DEBUG')
+    if isinstance(level, str):
+        level = level.upper()
+    if queued is None:
+        queued = os.getenv('DATALAKE_LOG_QUEUE', '') in ('1', 'true')
+
+    xlogger.setLevel(level)
 
     formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
     channel = logging.FileHandler(log_file) if log_file else \
         logging.StreamHandler(sys.stdout)
-    channel.setLevel(logging.DEBUG)
+    channel.setLevel(level)
     channel.setFormatter(formatter)
 
-    xlogger.addHandler(channel)
+    if not queued:
+        xlogger.addHandler(channel)
+        return xlogger
+
+    if not _queued_loggers:
+        atexit.register(_stop_log_listeners)
+        os.register_at_fork(after_in_child=_unqueue_loggers)
+    log_queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    listener = logging.handlers.QueueListener(
+        log_queue, channel, respect_handler_level=True)
+    listener.start()
+    _queued_loggers.append((xlogger, queue_handler, channel, listener))
+    xlogger.addHandler(queue_handler)
 
     return xlogger
 
 
 logger = get_logger(__file__)
 
+# Per file schemas are only cached on disk when opted in, the cache is
+# never pruned
+SCHEMA_CACHE_DIR = os.getenv('DATALAKE_SCHEMA_CACHE_DIR') or None
+
+
+ATTR_INDEX_REG_EXPR = re.compile(r'^(\w+)(\[)(\d+)(\])$')
+
 
 class ObjectDict(dict):
     """Provides dictionary with values also accessible by attribute
@@ -44,13 +143,12 @@ class ObjectDict(dict):
     """
 
     def __getattr__(self, attr):
-        attr_reg_expr = re.compile(r'^(\w+)(\[)(\d+)(\])$')
-        matches = re.findall(attr_reg_expr, attr)
+        match = ATTR_INDEX_REG_EXPR.match(attr)
         retval = self[attr]
 
-        if matches:
-            attr = matches[0][0]
-            index = int(matches[0][2])
+        if match:
+            attr = match.group(1)
+            index = int(match.group(3))
             retval = self[attr]
 
             if isinstance(retval, list):
@@ -68,16 +166,646 @@ class ObjectDict(dict):
             return None
 
 
-def dir_traverse(path):
-    for root, subdirs, files in os.walk(path):
-        for file in files:
-            fpath = os.path.join(root, file)
-            yield fpath
+# Leading bytes of valid files of each format, see is_valid_format
+FORMAT_MAGIC = {
+    'xml': b'<?xml',
+    'json': b'{',
+}
+
+
+class DirScanner:
+    """ Walks a directory tree in a single os.scandir pass, yielding the
+    os.DirEntry of every file like os.walk would list it
+
+    Files can be filtered on the way by extensions (a suffix or a tuple
+    of suffixes), hidden names (files and directories starting with '.')
+    and fileformat, whose leading bytes are checked as is_valid_format
+    does. Entries keep their stat data cached, with totals the scanned
+    files are also stat()ed and their sizes summed into total_size.
 
+    With workers, subtrees are scanned, and files checked, in a thread
+    pool and files come out in no particular order.
 
-def read_json(fpath, mode='r'):
-    with open(fpath, mode) as fp:
-        return rapidjson.load(fp)
+    """
+
+    def __init__(self, path, extensions=None, include_hidden=True,
+                 fileformat=None, totals=False, workers=None):
+        self.path = path
+        self.extensions = extensions
+        self.include_hidden = include_hidden
+        self.magic = FORMAT_MAGIC.get(fileformat)
+        self.totals = totals
+        self.workers = workers
+        self.total_files = 0
+        self.total_size = 0
+
+    def _accept(self, entry):
+        if not self.include_hidden and entry.name.startswith('.'):
+            return False
+        if self.extensions and not entry.name.endswith(self.extensions):
+            return False
+        if self.magic:
+            try:
+                with open(entry.path, 'rb') as fp:
+                    if fp.read(len(self.magic)) != self.magic:
+                        return False
+            except OSError:
+                return False
+        if self.totals:
+            entry.stat(follow_symlinks=False)
+        return True
+
+    def _scan(self, dirpath):
+        files, subdirs = [], []
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        # Symlinked directories are listed, not followed
+                        if not entry.is_symlink() and (
+                                self.include_hidden or
+                                not entry.name.startswith('.')):
+                            subdirs.append(entry.path)
+                    elif self._accept(entry):
+                        files.append(entry)
+        except OSError as error:
+            logger.debug('Failed to scan %s: %s', dirpath, error)
+        return files, subdirs
+
+    def _count(self, files):
+        self.total_files += len(files)
+        if self.totals:
+            self.total_size += sum(
+                entry.stat(follow_symlinks=False).st_size for entry in files)
+        return files
+
+    def _iter_sequential(self):
+        pending = [self.path]
+        while pending:
+            files, subdirs = self._scan(pending.pop())
+            yield from self._count(files)
+            pending.extend(reversed(subdirs))
+
+    def _iter_parallel(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {executor.submit(self._scan, self.path)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subdirs = future.result()
+                    pending.update(executor.submit(self._scan, subdir)
+                                   for subdir in subdirs)
+                    yield from self._count(files)
+
+    def __iter__(self):
+        if self.workers and self.workers > 1:
+            return self._iter_parallel()
+        return self._iter_sequential()
+
+
+def dir_traverse(path, **kwargs):
+    """ Yields the path of every file under path, see DirScanner for the
+    filters and workers kwargs
+
+    """
+    for entry in DirScanner(path, **kwargs):
+        yield entry.path
+
+
+class MappedReader:
+    """ File like reader over a memory mapped file with its own position,
+    so that readers of the same mapping do not get in each other's way
+
+    """
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.position = 0
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(
+            self.position + size, len(self.view))
+        chunk = self.view[self.position:end].tobytes()
+        self.position = end
+        return chunk
+
+    def release(self):
+        self.view.release()
+
+
+class MappedFiles:
+    """ Keeps read only memory maps of the files read in a run so that
+    every reader of a file shares one mapping and its page cache pages
+    instead of reading and decoding its own copy
+
+    Mappings are keyed by path, size and mtime and the least recently
+    used ones beyond max_open, and no longer in use, are closed.
+
+    """
+
+    def __init__(self, max_open=64):
+        self.max_open = max_open
+        self.maps = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def _acquire(self, fpath):
+        key = get_file_signature(fpath)
+        with self.lock:
+            entry = self.maps.get(key)
+            if entry is None:
+                entry = [self._map(fpath), 0]
+                self.maps[key] = entry
+            self.maps.move_to_end(key)
+            entry[1] += 1
+        return key, entry[0]
+
+    def _release(self, key):
+        with self.lock:
+            self.maps[key][1] -= 1
+            for stale_key in [stale_key for stale_key, (_, refs) in
+                              self.maps.items() if not refs][
+                    :max(len(self.maps) - self.max_open, 0)]:
+                self._unmap(self.maps.pop(stale_key)[0])
+
+    @staticmethod
+    def _map(fpath):
+        with open(fpath, 'rb') as fp:
+            try:
+                return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can not be mapped
+                return b''
+
+    @staticmethod
+    def _unmap(buffer):
+        if isinstance(buffer, mmap.mmap):
+            buffer.close()
+
+    @contextlib.contextmanager
+    def open(self, fpath):
+        """ Yields the mapped contents of fpath as a read only buffer
+
+        """
+        key, buffer = self._acquire(fpath)
+        try:
+            yield buffer
+        finally:
+            self._release(key)
+
+    @contextlib.contextmanager
+    def reader(self, fpath):
+        """ Yields a MappedReader over the mapped contents of fpath, e.g.
+        for ijson
+
+        """
+        with self.open(fpath) as buffer:
+            reader = MappedReader(buffer)
+            try:
+                yield reader
+            finally:
+                reader.release()
+
+    def close(self):
+        with self.lock:
+            for key in [key for key, (_, refs) in self.maps.items()
+                        if not refs]:
+                self._unmap(self.maps.pop(key)[0])
+
+
+mapped_files = MappedFiles()
+
+
+# Fastest first, DATALAKE_IJSON_BACKEND and DATALAKE_JSON_BACKEND force
+# one instead
+IJSON_BACKENDS = ('yajl2_c', 'yajl2_cffi', 'yajl2', 'python')
+JSON_BACKENDS = ('orjson', 'rapidjson', 'json')
+
+# orjson silently turns integers outside [-2 ** 63, 2 ** 64) into floats,
+# with no error to catch. Buffers holding a digit run that could be one,
+# 20 digits or 19 negative ones, are left to rapidjson instead. This is a
+# heuristic over the raw bytes: runs inside strings match too, which only
+# sends those documents down the slower, equally exact, rapidjson path.
+LONG_DIGITS_REG_EXPR = re.compile(rb'-\d{19}|\d{20}')
+
+
+# Array items as named in prefixes by the patched ijson the pipeline runs
+# on, so that they can not be mistaken for keys named item
+ARRAY_ITEM = 'xitem'
+
+
+def _array_item_prefix(parse):
+    return list(parse(io.BytesIO(b'[0]')))[1][0]
+
+
+def select_ijson_backend(names=None):
+    """ Returns the first importable ijson backend of names, skipping
+    those naming array items differently from the default backend, e.g.
+    unpatched ones next to a patched default
+
+    """
+    if os.getenv('DATALAKE_IJSON_BACKEND'):
+        names = names or [os.getenv('DATALAKE_IJSON_BACKEND')]
+    item_prefix = _array_item_prefix(ijson.parse)
+    for name in names or IJSON_BACKENDS:
+        try:
+            backend = importlib.import_module(
+                'ijson.backends.{}'.format(name))
+        except (ImportError, OSError):
+            continue
+        if _array_item_prefix(backend.parse) != item_prefix:
+            logger.debug('Skipping ijson backend %s, array items differ',
+                         name)
+            continue
+        return name, backend
+    return getattr(ijson, 'backend', 'default'), ijson
+
+
+def _orjson_loads(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if LONG_DIGITS_REG_EXPR.search(data):
+        return rapidjson.loads(bytes(data))
+    with memoryview(data) as view:
+        return orjson.loads(view)
+
+
+def _rapidjson_dumps(obj):
+    return rapidjson.dumps(obj, number_mode=rapidjson.NM_DECIMAL).encode(
+        'utf-8')
+
+
+def _orjson_default(obj):
+    # Decimals, which ijson yields for non integer numbers, are written
+    # as they read instead of going through floats
+    if isinstance(obj, Decimal):
+        return orjson.Fragment(str(obj))
+    raise TypeError
+
+
+def _orjson_dumps(obj):
+    try:
+        return orjson.dumps(obj, default=_orjson_default)
+    except TypeError:
+        # Integers beyond 64 bits are only serialised by rapidjson
+        return _rapidjson_dumps(obj)
+
+
+def _json_dumps(obj):
+    try:
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    except TypeError:
+        return _rapidjson_dumps(obj)
+
+
+def _rapidjson_loads(data):
+    return rapidjson.loads(
+        data if isinstance(data, (str, bytes)) else bytes(data))
+
+
+def _json_loads(data):
+    return json.loads(
+        data if isinstance(data, (str, bytes)) else bytes(data))
+
+
+def select_json_backend(names=None):
+    """ Returns (name, loads, dumps) of the first available JSON backend
+    of names. loads takes str, bytes or any bytes like buffer, which
+    orjson parses without copying. dumps returns compact UTF-8 bytes,
+    serialising Decimals exactly whatever the backend: orjson through
+    orjson.Fragment, from orjson 3.9 on, the json module by falling back
+    to rapidjson. Older orjson versions dump through rapidjson instead.
+
+    """
+    if os.getenv('DATALAKE_JSON_BACKEND'):
+        names = names or [os.getenv('DATALAKE_JSON_BACKEND')]
+    for name in names or JSON_BACKENDS:
+        if name == 'orjson' and orjson is not None:
+            return name, _orjson_loads, _orjson_dumps if hasattr(
+                orjson, 'Fragment') else _rapidjson_dumps
+        elif name == 'rapidjson':
+            return name, _rapidjson_loads, _rapidjson_dumps
+        elif name == 'json':
+            return name, _json_loads, _json_dumps
+    raise ValueError('No JSON backend available among {}'.format(names))
+
+
+IJSON_BACKEND, ijson_backend = select_ijson_backend()
+IJSON_ARRAY_ITEM = _array_item_prefix(ijson_backend.parse)
+JSON_BACKEND, json_loads, json_dumps = select_json_backend()
+logger.debug('JSON backends - incremental: %s, full: %s',
+             IJSON_BACKEND, JSON_BACKEND)
+if IJSON_ARRAY_ITEM != ARRAY_ITEM:
+    logger.debug('ijson names array items %s, prefixing its events as %s',
+                 IJSON_ARRAY_ITEM, ARRAY_ITEM)
+
+
+def _prefixed_events(events):
+    """ Prefixes ijson basic_parse events the way ijson parse does,
+    except that array items are named ARRAY_ITEM
+
+    Only the prefix components standing for array items are named so,
+    keys named like array items are kept as they are.
+
+    """
+    # Prefix of every open container
+    containers = []
+    prefix = ''
+    for event, value in events:
+        if event == 'map_key':
+            parent = containers[-1]
+            yield parent, event, value
+            # The root has no prefix, unlike keys that are empty strings
+            prefix = '{}.{}'.format(
+                parent, value) if len(containers) > 1 else value
+            continue
+        if event in ('end_map', 'end_array'):
+            prefix = containers.pop()
+            yield prefix, event, value
+            continue
+        yield prefix, event, value
+        if event == 'start_map':
+            containers.append(prefix)
+        elif event == 'start_array':
+            containers.append(prefix)
+            prefix = '{}.{}'.format(
+                prefix, ARRAY_ITEM) if len(containers) > 1 else ARRAY_ITEM
+
+
+def ijson_parse(source):
+    """ Parses source into ijson events, array items being named
+    ARRAY_ITEM whatever the ijson installed
+
+    An ijson naming them otherwise, e.g. a stock one naming them item,
+    only has its basic events used, see _prefixed_events.
+
+    """
+    if IJSON_ARRAY_ITEM != ARRAY_ITEM:
+        return _prefixed_events(ijson_backend.basic_parse(source))
+    return ijson_backend.parse(source)
+
+
+def json_dump(obj, fp):
+    """ Serialises obj into fp, opened in binary mode
+
+    """
+    fp.write(json_dumps(obj))
+
+
+def read_json(fpath):
+    if hasattr(fpath, 'read'):
+        return json_loads(fpath.read())
+    with mapped_files.open(fpath) as buffer:
+        return json_loads(buffer)
+
+
+def get_file_hash(fpath):
+    with mapped_files.open(fpath) as buffer:
+        return hashlib.sha256(buffer).hexdigest()
+
+
+class TransformManifest:
+    """Records processed source files in a SQLite database so that
+    unchanged files can be skipped on later runs
+
+    Each entry holds the source size, mtime and SHA-256 along with the S3
+    key and ETag of the transformed output, and the fingerprint of what
+    else the output was built from, e.g. the transformation prefixes.
+
+    """
+
+    COLUMNS = ('size', 'mtime_ns', 'sha256', 's3_key', 'etag',
+               'fingerprint')
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS manifest ('
+                'source_path TEXT PRIMARY KEY, '
+                'size INTEGER, '
+                'mtime_ns INTEGER, '
+                'sha256 TEXT, '
+                's3_key TEXT, '
+                'etag TEXT, '
+                'updated_at TEXT, '
+                'fingerprint TEXT)')
+            columns = [row[1] for row in self.connection.execute(
+                'PRAGMA table_info(manifest)')]
+            # Manifests written before fingerprints, whose entries then
+            # all count as changed
+            if 'fingerprint' not in columns:
+                self.connection.execute(
+                    'ALTER TABLE manifest ADD COLUMN fingerprint TEXT')
+
+    def get(self, fpath):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT {} FROM manifest WHERE source_path = ?'.format(
+                    ', '.join(self.COLUMNS)),
+                (os.path.abspath(fpath),)).fetchone()
+        if not row:
+            return None
+        return ObjectDict(zip(self.COLUMNS, row))
+
+    def is_unchanged(self, fpath, stat=None, fingerprint=None, s3_key=None):
+        """ Compares size and mtime first, hashing only when the mtime
+        moved without a size change. stat, e.g. cached by DirScanner,
+        saves stat()ing fpath again.
+
+        Files recorded with another fingerprint, or uploaded to another
+        key than s3_key when given, count as changed.
+
+        """
+        entry = self.get(fpath)
+        if not entry:
+            return False
+        if entry.fingerprint != fingerprint or (
+                s3_key is not None and entry.s3_key != s3_key):
+            return False
+        stat = stat or os.stat(fpath)
+        if stat.st_size != entry.size:
+            return False
+        if stat.st_mtime_ns == entry.mtime_ns:
+            return True
+        if get_file_hash(fpath) != entry.sha256:
+            return False
+        self.record(fpath, entry.s3_key, entry.etag, entry.sha256,
+                    entry.fingerprint)
+        return True
+
+    def record(self, fpath, s3_key, etag, sha256=None, fingerprint=None):
+        stat = os.stat(fpath)
+        sha256 = sha256 or get_file_hash(fpath)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO manifest (source_path, size, '
+                'mtime_ns, sha256, s3_key, etag, updated_at, fingerprint) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (os.path.abspath(fpath), stat.st_size, stat.st_mtime_ns,
+                 sha256, s3_key, etag, get_timestamp(2), fingerprint))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+COMPRESSION_EXTENSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+
+def open_compressed(fpath, mode='rb'):
+    """ Opens plain, gzip (.gz) or zstandard (.zst) files alike
+
+    """
+    if fpath.endswith('.gz'):
+        return gzip.open(fpath, mode)
+    if fpath.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('zstandard is required for .zst files')
+        return zstandard.open(fpath, mode)
+    return open(fpath, mode)
+
+
+class RollingJsonLinesWriter:
+    """Appends serialised JSON documents as lines to part files, rolling
+    over to a new part once max_bytes (uncompressed) or max_records is
+    reached
+
+    on_close, if given, is called with the path of every completed part
+    and the sources written to it. Parts are named <prefix>-<index>, so
+    that a rerun overwrites the parts of the previous one.
+
+    """
+
+    def __init__(
+            self,
+            dest_dir,
+            prefix='part',
+            max_bytes=128 * 1024 * 1024,
+            max_records=None,
+            compression=None,
+            on_close=None):
+        if compression and compression not in COMPRESSION_EXTENSIONS:
+            raise ValueError('Unknown compression {}'.format(compression))
+        self.dest_dir = dest_dir
+        self.prefix = prefix
+        self.extension = '.jsonl{}'.format(
+            COMPRESSION_EXTENSIONS.get(compression, ''))
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.on_close = on_close
+        self.part_idx = 0
+        self.part_fp = None
+
+    def _next_part_path(self):
+        part_path = os.path.join(self.dest_dir, '{}-{:05d}{}'.format(
+            self.prefix, self.part_idx, self.extension))
+        self.part_idx += 1
+        self.part_size = 0
+        self.part_records = 0
+        self.part_sources = []
+        return part_path
+
+    def _open(self):
+        self.part_path = self._next_part_path()
+        self.part_fp = open_compressed(self.part_path, 'wb')
+
+    def _roll(self):
+        self.part_fp.close()
+        self.part_fp = None
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Wrote %s records (%s) to %s', self.part_records,
+                         readable_size(self.part_size), self.part_path)
+        if self.on_close:
+            self.on_close(self.part_path, self.part_sources)
+
+    def write(self, line, source=None):
+        if self.part_fp is None:
+            self._open()
+        self.part_fp.write(line)
+        self.part_fp.write(b'\n')
+        self.part_size += len(line) + 1
+        self.part_records += 1
+        if source:
+            self.part_sources.append(source)
+
+        if self.part_size >= self.max_bytes or (
+                self.max_records and self.part_records >= self.max_records):
+            self._roll()
+
+    def close(self):
+        if self.part_fp is not None:
+            self._roll()
+
+
+class RollingParquetWriter(RollingJsonLinesWriter):
+    """Same as RollingJsonLinesWriter for rows fitted to arrow_schema, see
+    arrow_row, written to Parquet part files in row groups of
+    row_group_size rows
+
+    max_bytes caps the in memory Arrow size of the row groups of a part.
+    compression is any Parquet codec, snappy by default.
+
+    """
+
+    def __init__(
+            self,
+            dest_dir,
+            arrow_schema,
+            prefix='part',
+            max_bytes=128 * 1024 * 1024,
+            max_records=None,
+            compression=None,
+            on_close=None,
+            row_group_size=16 * 1024):
+        if pyarrow is None:
+            raise ImportError('pyarrow is required for parquet output')
+        super().__init__(dest_dir, prefix, max_bytes, max_records,
+                         on_close=on_close)
+        self.extension = '.parquet'
+        self.arrow_schema = arrow_schema
+        self.compression = compression or 'snappy'
+        self.row_group_size = row_group_size
+        self.rows = []
+
+    def _open(self):
+        self.part_path = self._next_part_path()
+        self.part_fp = pyarrow.parquet.ParquetWriter(
+            self.part_path, self.arrow_schema, compression=self.compression)
+
+    def _flush(self):
+        table = pyarrow.Table.from_pylist(self.rows, schema=self.arrow_schema)
+        self.part_fp.write_table(table)
+        self.part_size += table.nbytes
+        self.rows = []
+
+    def _roll(self):
+        if self.rows:
+            self._flush()
+        super()._roll()
+
+    def write(self, row, source=None):
+        if self.part_fp is None:
+            self._open()
+        self.rows.append(row)
+        self.part_records += 1
+        if source:
+            self.part_sources.append(source)
+
+        if len(self.rows) < self.row_group_size and not (
+                self.max_records and self.part_records >= self.max_records):
+            return
+        self._flush()
+        if self.part_size >= self.max_bytes or (
+                self.max_records and self.part_records >= self.max_records):
+            self._roll()
 
 
 def transform_name_to_uuid(filename):
@@ -93,6 +821,10 @@ def should_extract(filename, source_fileformat):
 
 
 def is_valid_format(filepath, fileformat):
+    if hasattr(filepath, 'read'):
+        magic = FORMAT_MAGIC.get(fileformat)
+        return not magic or peek_bytes(filepath, len(magic)) == magic
+
     with open(filepath) as f:
         if fileformat == 'xml':
             return f.read(5) == '<?xml'
@@ -101,17 +833,14 @@ def is_valid_format(filepath, fileformat):
     return True
 
 
-def get_dir_tree_size(path):
+def get_dir_tree_size(path, workers=None):
     """ Returns total size of files in a given path and subdirs
 
     """
-    total = 0
-    for entry in os.scandir(path):
-        if entry.is_dir(follow_symlinks=False):
-            total += get_dir_tree_size(entry.path)
-        else:
-            total += entry.stat(follow_symlinks=False).st_size
-    return total
+    scanner = DirScanner(path, totals=True, workers=workers)
+    for _ in scanner:
+        pass
+    return scanner.total_size
 
 
 def size_formatter(value, unit, is_speed=False):
@@ -176,6 +905,275 @@ def get_timestamp(formatter_type=1):
         return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
 
+def percentile(sorted_values, fraction):
+    """ Nearest rank percentile of already sorted values
+
+    """
+    if not sorted_values:
+        return 0
+    rank = max(int(math.ceil(fraction * len(sorted_values))), 1)
+    return sorted_values[rank - 1]
+
+
+class Metrics:
+    """ Collects samples, such as stage durations or file sizes, and
+    counters from any thread
+
+    Worker processes record into their own instance and hand
+    snapshot(reset=True) back to the parent which merge()s it. summary()
+    gives the count, total, p50, p95 and max of every sample.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.samples = dict()
+            self.units = dict()
+            self.counters = dict()
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, value, unit='seconds'):
+        with self.lock:
+            self.samples.setdefault(name, []).append(value)
+            self.units[name] = unit
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self, reset=False):
+        with self.lock:
+            snapshot = {
+                'samples': {name: list(values)
+                            for name, values in self.samples.items()},
+                'units': dict(self.units),
+                'counters': dict(self.counters),
+            }
+        if reset:
+            self.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        with self.lock:
+            for name, values in snapshot['samples'].items():
+                self.samples.setdefault(name, []).extend(values)
+            self.units.update(snapshot['units'])
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        with self.lock:
+            samples = {name: sorted(values)
+                       for name, values in self.samples.items()}
+            units = dict(self.units)
+            counters = dict(self.counters)
+
+        return {
+            'samples': {name: {
+                'unit': units[name],
+                'count': len(values),
+                'total': sum(values),
+                'p50': percentile(values, 0.5),
+                'p95': percentile(values, 0.95),
+                'max': values[-1] if values else 0,
+            } for name, values in samples.items()},
+            'counters': counters,
+        }
+
+    def log_summary(self, xlogger=None):
+        xlogger = xlogger or logger
+        summary = self.summary()
+        for name, stats in sorted(summary['samples'].items()):
+            if stats['unit'] == 'bytes':
+                values = [readable_size(stats[key])
+                          for key in ('total', 'p50', 'p95', 'max')]
+            else:
+                values = ['{:.4f} secs'.format(stats[key])
+                          for key in ('total', 'p50', 'p95', 'max')]
+            xlogger.debug(
+                '{} - Count: {}, Total: {}, p50: {}, p95: {}, '
+                'max: {}'.format(name, stats['count'], *values))
+        for name, value in sorted(summary['counters'].items()):
+            xlogger.debug('{}: {}'.format(name, value))
+
+    def to_json(self):
+        return rapidjson.dumps(self.summary(), indent=2)
+
+    def to_prometheus(self, namespace='datalake'):
+        summary = self.summary()
+        lines = []
+        for name, stats in sorted(summary['samples'].items()):
+            metric = '{}_{}_{}'.format(namespace, name, stats['unit'])
+            lines.append('# TYPE {} summary'.format(metric))
+            for quantile, key in (('0.5', 'p50'), ('0.95', 'p95')):
+                lines.append('{}{{quantile="{}"}} {}'.format(
+                    metric, quantile, stats[key]))
+            lines.append('{}_sum {}'.format(metric, stats['total']))
+            lines.append('{}_count {}'.format(metric, stats['count']))
+            lines.append('# TYPE {}_max gauge'.format(metric))
+            lines.append('{}_max {}'.format(metric, stats['max']))
+        for name, value in sorted(summary['counters'].items()):
+            metric = '{}_{}_total'.format(namespace, name)
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{} {}'.format(metric, value))
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, fpath):
+        """ Writes the summary to fpath, in the Prometheus text format
+        when it ends with .prom and as JSON otherwise
+
+        """
+        with open(fpath, 'w') as fp:
+            fp.write(self.to_prometheus() if fpath.endswith(
+                '.prom') else self.to_json())
+
+
+PROFILE_MODES = ('cpu', 'memory')
+
+
+class Profiler:
+    """ Opt-in cProfile and tracemalloc profiling
+
+    modes is a list or a comma separated string of 'cpu' and 'memory'
+    ('all' for both), defaulting to the DATALAKE_PROFILE environment
+    variable. Profiling is off when no mode is given. With every, or
+    DATALAKE_PROFILE_EVERY, only every Nth file of those handed to
+    select() is profiled, on its own, instead of the whole run.
+
+    Each profile writes <name>-<label>.pstats for cpu and
+    <name>-<label>.allocations.txt, the top allocations by line, for
+    memory into output_dir, or DATALAKE_PROFILE_DIR when set.
+
+    """
+
+    def __init__(self, name, output_dir, modes=None, every=None, top=25):
+        if modes is None:
+            modes = os.getenv('DATALAKE_PROFILE', '')
+        if isinstance(modes, str):
+            modes = modes.split(',')
+        modes = set(mode.strip().lower() for mode in modes if mode.strip())
+        if modes & {'all', '1', 'true'}:
+            modes = set(PROFILE_MODES)
+        unknown = modes.difference(PROFILE_MODES)
+        if unknown:
+            raise ValueError('Unknown profile modes: {}'.format(
+                ', '.join(sorted(unknown))))
+
+        self.name = name
+        self.modes = modes
+        if every is None:
+            every = os.getenv('DATALAKE_PROFILE_EVERY')
+        self.every = int(every or 0)
+        self.output_dir = os.getenv('DATALAKE_PROFILE_DIR') or output_dir
+        self.top = top
+        self.sampled = dict()
+
+    @property
+    def enabled(self):
+        return bool(self.modes)
+
+    def select(self, fpaths):
+        """ Picks every Nth of fpaths for sample() to profile
+
+        """
+        if self.enabled and self.every:
+            self.sampled = {fpath: idx for idx, fpath in enumerate(
+                fpaths) if not idx % self.every}
+
+    def run(self):
+        """ Profiles the enclosed block as a whole unless sampling
+
+        """
+        if not self.enabled or self.every:
+            return contextlib.nullcontext()
+        return self.profile(get_timestamp())
+
+    def sample(self, fpath):
+        if fpath not in self.sampled:
+            return contextlib.nullcontext()
+        return self.profile('{:05d}-{}'.format(
+            self.sampled[fpath], ntpath.basename(fpath)))
+
+    @contextlib.contextmanager
+    def profile(self, label):
+        profile = cProfile.Profile() if 'cpu' in self.modes else None
+        tracing = 'memory' in self.modes and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+            os.makedirs(self.output_dir, exist_ok=True)
+            base_path = os.path.join(
+                self.output_dir, '{}-{}'.format(self.name, label))
+            if profile:
+                profile.dump_stats('{}.pstats'.format(base_path))
+                logger.debug('CPU profile written to {}.pstats'.format(
+                    base_path))
+            if 'memory' in self.modes:
+                self._write_allocations(
+                    '{}.allocations.txt'.format(base_path))
+                if tracing:
+                    tracemalloc.stop()
+
+    def _write_allocations(self, fpath):
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, cProfile.__file__)])
+        with open(fpath, 'w') as fp:
+            fp.write('Current: {}, Peak: {}\n\n'.format(
+                readable_size(current), readable_size(peak)))
+            fp.write('Top {} allocations:\n'.format(self.top))
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                fp.write('{}\n'.format(stat))
+        logger.debug('Allocation report written to {}'.format(fpath))
+
+
+def profiled(name, output_dir):
+    """ Profiles whole calls of the decorated function through a Profiler
+    configured from its profile and profile_every arguments, if any, and
+    the environment. Functions without profile_every are never sampled.
+
+    output_dir receives the bound arguments of the call and returns the
+    directory the reports go to.
+
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            profiler = Profiler(
+                name, output_dir(bound.arguments),
+                modes=bound.arguments.get('profile'),
+                every=bound.arguments.get('profile_every', 0))
+            with profiler.run():
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
 def get_aws_session(old=False):
     if old:
         aws_access_key_id = 'XXXXXXXXXXXX'
@@ -197,10 +1195,16 @@ def get_aws_session(old=False):
     return session
 
 
-def get_s3_client(old=False):
+def get_s3_client(old=False, max_pool_connections=None):
     session = get_aws_session(old)
+    config = BotoConfig(
+        max_pool_connections=max_pool_connections
+    ) if max_pool_connections else None
 
-    return session.client('s3')
+    return session.client(
+        's3',
+        config=config,
+        endpoint_url=os.getenv('LAMBDA_AWS_S3_ENDPOINT_URL'))
 
 
 def get_sns_client():
@@ -267,6 +1271,122 @@ def s3_download_file(s3_file_key, bucket_name=None, output_dir=None):
     return local_file
 
 
+class S3Uploader:
+    """Uploads files to S3 from a thread pool fed by a bounded queue
+
+    submit() blocks once max_queue_size uploads are pending, so producers
+    keep working while uploads drain without piling up local files.
+    Without an s3_client, one with a connection pool sized for all
+    workers and their multipart threads is created. An optional callback
+    receives the S3 key and ETag of every completed upload. Upload
+    durations and bytes are recorded into metrics, a Metrics, if given.
+
+    Failed uploads are logged and kept in failures as (fpath, s3_key,
+    error), raise_for_failures() raises once they are all done.
+
+    """
+
+    def __init__(
+            self,
+            bucket_name,
+            s3_client=None,
+            max_workers=8,
+            max_queue_size=64,
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=4,
+            metrics=None):
+        self.bucket_name = bucket_name
+        self.metrics = metrics
+        self.s3_client = s3_client or get_s3_client(
+            max_pool_connections=max_workers * max_concurrency)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.slots = threading.BoundedSemaphore(max_queue_size)
+        self.lock = threading.Lock()
+        self.start_time = None
+        self.total_bytes = 0
+        self.uploaded = 0
+        self.failed = 0
+        self.failures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, fpath, s3_key, callback=None):
+        if self.start_time is None:
+            self.start_time = time.time()
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(
+                self._upload, fpath, s3_key, callback)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+
+        return future
+
+    def _upload(self, fpath, s3_key, callback):
+        upload_start = time.perf_counter()
+        try:
+            size = os.path.getsize(fpath)
+            self.s3_client.upload_file(
+                fpath,
+                self.bucket_name,
+                s3_key,
+                Config=self.transfer_config)
+            etag = self.s3_client.head_object(
+                Bucket=self.bucket_name,
+                Key=s3_key)['ETag'] if callback else None
+        except Exception as error:
+            logger.exception('Failed to upload {} to {}'.format(
+                fpath, s3_key))
+            with self.lock:
+                self.failed += 1
+                self.failures.append((fpath, s3_key, error))
+            if self.metrics:
+                self.metrics.incr('failed_uploads')
+            return
+
+        with self.lock:
+            self.total_bytes += size
+            self.uploaded += 1
+        if self.metrics:
+            self.metrics.observe('upload', time.perf_counter() - upload_start)
+            self.metrics.incr('uploaded_bytes', size)
+        logger.debug('%s uploaded to %s', fpath, s3_key)
+
+        if callback:
+            callback(s3_key, etag)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+        elapsed = max(time.time() - (self.start_time or time.time()), 1e-6)
+        logger.debug(
+            'Uploaded {} files ({}) in {} at {}, {} failed'.format(
+                self.uploaded,
+                readable_size(self.total_bytes),
+                readable_time(elapsed),
+                readable_size(round(self.total_bytes / elapsed, 2),
+                              is_speed=True),
+                self.failed))
+
+    def raise_for_failures(self):
+        if not self.failures:
+            return
+        fpath, s3_key, error = self.failures[0]
+        raise RuntimeError('{} uploads failed, {} to {} first'.format(
+            len(self.failures), fpath, s3_key)) from error
+
+
 def is_empty_file(xfile):
     return os.stat(xfile).st_size == 0
 
@@ -282,21 +1402,169 @@ def fetch_filename_stem(filename):
     return stem
 
 
-def zip_extractor(infile, out_dir):
+ARCHIVE_FORMATS = ('zip', 'gzip', 'tar')
+
+ARCHIVE_EXTENSIONS = ('.zip', '.gz', '.tgz', '.tar')
+
+
+def _is_seekable(fileobj):
+    seekable = getattr(fileobj, 'seekable', None)
+    try:
+        return seekable() if seekable else hasattr(fileobj, 'seek')
+    except (AttributeError, OSError, ValueError):
+        # e.g. members of a tar stream ask their stream, which can not say
+        return False
+
+
+def peek_bytes(fileobj, size):
+    """ Returns up to size leading bytes of a binary file object without
+    consuming them
+
+    """
+    peek = getattr(fileobj, 'peek', None)
+    if peek:
+        # Seeking back within a decompressed stream may mean rewinding it
+        return peek(size)[:size]
+    if not _is_seekable(fileobj):
+        return b''
+    position = fileobj.tell()
+    head = fileobj.read(size)
+    fileobj.seek(position)
+    return head
+
+
+def get_archive_format(fileobj, formats=ARCHIVE_FORMATS):
+    head = peek_bytes(fileobj, 512)
+    if 'gzip' in formats and head[:2] == b'\x1f\x8b':
+        return 'gzip'
+    if 'zip' in formats and head[:4] in (b'PK\x03\x04', b'PK\x05\x06'):
+        return 'zip'
+    if 'tar' in formats and head[257:262] == b'ustar':
+        return 'tar'
+    return None
+
+
+def _spool(fileobj, spool_size):
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    shutil.copyfileobj(fileobj, spool, 1024 * 1024)
+    spool.seek(0)
+    return spool
+
+
+def _iter_zip_members(inzip, workers, spool_size):
+    members = [info for info in inzip.infolist() if not info.is_dir()]
+    if not workers or workers < 2:
+        for info in members:
+            with inzip.open(info) as member:
+                yield info.filename, member
+        return
+
+    def decompress(info):
+        with inzip.open(info) as member:
+            return _spool(member, spool_size)
+
+    # Up to workers members are decompressed ahead of the consumer
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for info in members:
+            pending.append((info.filename, executor.submit(decompress, info)))
+            if len(pending) > workers:
+                member_name, future = pending.popleft()
+                with future.result() as member:
+                    yield member_name, member
+        while pending:
+            member_name, future = pending.popleft()
+            with future.result() as member:
+                yield member_name, member
+
+
+def iter_archive(source, name=None, formats=ARCHIVE_FORMATS, workers=None,
+                 spool_size=64 * 1024 * 1024, extensions=None):
+    """ Yields (member_name, file object) for every file in an archive
+    without extracting it to disk
+
+    source is a path or a binary file object. zip, gzip and tar archives,
+    told apart by their magic bytes, are opened as streams and archives
+    nested in them are walked in turn, only those in formats and, with
+    extensions, named with one of them (e.g. ARCHIVE_EXTENSIONS, so that
+    zip based documents such as .docx stay whole). Members are named
+    relative to their innermost archive, gzip members after the gzip
+    file without its .gz extension. Anything else is yielded as is.
+
+    A file object is only valid until the next member is requested. With
+    workers, zip members are decompressed ahead in a thread pool, members
+    up to spool_size bytes in memory and larger ones in temporary files.
+
+    """
+    if not hasattr(source, 'read'):
+        with open(source, 'rb') as fp:
+            yield from iter_archive(
+                fp, name or ntpath.basename(source), formats, workers,
+                spool_size, extensions)
+        return
+
+    archive_format = None
+    if not extensions or (name or '').lower().endswith(extensions):
+        archive_format = get_archive_format(source, formats)
+    if archive_format == 'gzip':
+        if name and name.endswith('.tgz'):
+            name = '{}.tar'.format(name[:-4])
+        elif name and name.endswith('.gz'):
+            name = name[:-3]
+        with gzip.GzipFile(fileobj=source, mode='rb') as member:
+            yield from iter_archive(
+                member, name, formats, workers, spool_size, extensions)
+    elif archive_format == 'zip':
+        # Seeking within a compressed member means decompressing it again
+        if isinstance(source, zipfile.ZipExtFile) or not _is_seekable(
+                source):
+            source = _spool(source, spool_size)
+        with zipfile.ZipFile(source, 'r') as inzip:
+            for member_name, member in _iter_zip_members(
+                    inzip, workers, spool_size):
+                yield from iter_archive(
+                    member, member_name, formats, workers, spool_size,
+                    extensions)
+    elif archive_format == 'tar':
+        with tarfile.open(fileobj=source, mode='r|') as intar:
+            for info in intar:
+                if not info.isfile():
+                    continue
+                yield from iter_archive(
+                    intar.extractfile(info), info.name, formats, workers,
+                    spool_size, extensions)
+    else:
+        yield name, source
+
+
+def _member_path(out_dir, member_name):
+    # Same as extractall, never write outside of out_dir
+    parts = [part for part in re.split(r'[\\/]+', member_name)
+             if part not in ('', '.', '..')]
+    return os.path.join(out_dir, *parts) if parts else None
+
+
+def zip_extractor(infile, out_dir, workers=None):
+    """ Extracts a zip file, and the .zip files nested in it, into out_dir
+    straight from the archive then removes it
+
+    """
     if not zipfile.is_zipfile(
             infile) or not infile.endswith('.zip'):
         return
 
-    with zipfile.ZipFile(infile, 'r') as inzip:
-        file_list = inzip.namelist()
-        inzip.extractall(out_dir)
-        file_list = [os.path.join(out_dir, f) for f in file_list]
+    for member_name, member in iter_archive(
+            infile, formats=('zip',), workers=workers,
+            extensions=ARCHIVE_EXTENSIONS):
+        member_path = _member_path(out_dir, member_name)
+        if not member_path:
+            continue
+        os.makedirs(os.path.dirname(member_path), exist_ok=True)
+        with open(member_path, 'wb') as fp:
+            shutil.copyfileobj(member, fp, 1024 * 1024)
 
     os.remove(infile)
 
-    for filename in filter(zipfile.is_zipfile, file_list):
-        zip_extractor(filename, out_dir)
-
 
 def gzip_extractor(infile, outfile):
     with gzip.open(infile, 'rb') as inf:
@@ -313,6 +1581,172 @@ def bulk_delete_files(xfiles):
             os.remove(xfile)
 
 
+def iter_object_pages(
+        s3_client,
+        bucket_name,
+        prefix,
+        page_limit,
+        pages=None,
+        delimiter='',
+        workers=None):
+    """ Lazily yields pages (lists of object summaries) under a prefix
+    using list_objects_v2
+
+    With workers > 1 and no delimiter, the sub-prefixes one level below
+    prefix are discovered with a '/' delimiter and listed in parallel
+    threads, pages being handed over through a bounded queue. Pages then
+    arrive in completion order rather than key order. Fan-out stops at
+    that first level, so keys all under a single sub-prefix are still
+    listed by one thread, list from deeper prefixes for those.
+
+    """
+    params = dict(
+        Bucket=bucket_name,
+        Prefix=prefix,
+        PaginationConfig=dict(PageSize=page_limit))
+    paginator = s3_client.get_paginator('list_objects_v2')
+    max_pages = pages if isinstance(pages, int) else None
+
+    if not workers or workers < 2 or delimiter:
+        for page_idx, page in enumerate(paginator.paginate(
+                Delimiter=delimiter, **params)):
+            if max_pages is not None and page_idx >= max_pages:
+                return
+            yield page.get('Contents', [])
+        return
+
+    sub_prefixes = []
+    page_idx = 0
+    for page in paginator.paginate(Delimiter='/', **params):
+        sub_prefixes.extend(
+            item['Prefix'] for item in page.get('CommonPrefixes', []))
+        if page.get('Contents'):
+            if max_pages is not None and page_idx >= max_pages:
+                return
+            page_idx += 1
+            yield page['Contents']
+
+    if not sub_prefixes:
+        return
+
+    pages_queue = queue.Queue(maxsize=workers * 4)
+    stop = threading.Event()
+    finished = object()
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                pages_queue.put(value, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce(sub_prefix):
+        try:
+            sub_params = dict(params, Prefix=sub_prefix)
+            for page in paginator.paginate(**sub_params):
+                if stop.is_set():
+                    break
+                put(page.get('Contents', []))
+        except Exception as error:
+            put(error)
+        finally:
+            put(finished)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    for sub_prefix in sub_prefixes:
+        executor.submit(produce, sub_prefix)
+
+    try:
+        remaining = len(sub_prefixes)
+        while remaining:
+            page = pages_queue.get()
+            if page is finished:
+                remaining -= 1
+                continue
+            if isinstance(page, Exception):
+                raise page
+            if max_pages is not None and page_idx >= max_pages:
+                return
+            page_idx += 1
+            yield page
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+
+
+def iter_objects(*args, **kwargs):
+    """ Lazily yields object summaries, see iter_object_pages
+
+    """
+    for page in iter_object_pages(*args, **kwargs):
+        yield from page
+
+
+def iter_keys(*args, **kwargs):
+    for item in iter_objects(*args, **kwargs):
+        yield item['Key']
+
+
+def delete_keys(s3_client, bucket_name, keys, batch_size=1000):
+    """ Deletes keys through delete_objects in batches of up to 1000,
+    the most S3 accepts per request
+
+    """
+    total_deleted = 0
+    for batch in chunked(keys, batch_size):
+        resp = s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete=dict(
+                Objects=[dict(Key=key) for key in batch],
+                Quiet=True))
+        errors = resp.get('Errors', [])
+        for error in errors:
+            logger.debug('Failed to delete %s: %s',
+                         error['Key'], error.get('Message'))
+        total_deleted += len(batch) - len(errors)
+        logger.debug('Deleted %s objects', len(batch) - len(errors))
+
+    return total_deleted
+
+
+def reservoir_sample(iterable, k, seed=None, weight=None):
+    """ Draws k items from an iterable of unknown length in O(k) memory
+
+    Uniform by default (Algorithm R). With a weight function, items are
+    drawn with probability proportional to their weight (A-Res) and items
+    weighing nothing are never picked. A seed makes the sample
+    reproducible.
+
+    """
+    rng = random.Random(seed)
+
+    if weight is None:
+        sample = []
+        for idx, item in enumerate(iterable):
+            if idx < k:
+                sample.append(item)
+                continue
+            replace_idx = rng.randint(0, idx)
+            if replace_idx < k:
+                sample[replace_idx] = item
+        return sample
+
+    heap = []
+    for idx, item in enumerate(iterable):
+        item_weight = weight(item)
+        if item_weight <= 0:
+            continue
+        key = rng.random() ** (1.0 / item_weight)
+        if len(heap) < k:
+            heapq.heappush(heap, (key, idx, item))
+        elif key > heap[0][0]:
+            heapq.heapreplace(heap, (key, idx, item))
+    return [item for key, idx, item in sorted(heap, reverse=True)]
+
+
+@profiled('list_dir', lambda arguments: arguments[
+    'profile_dir'] or os.getcwd())
 def list_dir(
         s3_client,
         bucket_name,
@@ -328,183 +1762,475 @@ def list_dir(
         write_full_key=False,
         delete_object=False,
         pick_random=False,
-        random_size=3):
-    params = dict(
-        Bucket=bucket_name,
-        Prefix=prefix,
-        PaginationConfig=dict(PageSize=page_limit),
-        Delimiter=delimiter)
-    paginator = s3_client.get_paginator('list_objects')
-    piterator = iter(paginator.paginate(**params))
+        random_size=3,
+        workers=None,
+        random_seed=None,
+        weight_by_size=False,
+        profile=None,
+        profile_dir=None):
+    """ Lists the objects under a prefix, see iter_objects for pages,
+    delimiter and workers
+
+    Returns (keys, total objects, total size), or (total objects,
+    readable total size) with count_only. Keys come back as a list,
+    holding every key in memory, because the totals returned along with
+    them are only known once the listing is over and callers index and
+    re-read the keys. Listings too large for that should iterate
+    iter_keys or iter_objects instead, which hold one page at a time.
+    With pick_random, a sample of random_size keys is returned.
+
+    """
+    if pick_random and random_seed is not None:
+        # Parallel pages come in completion order, a seed only reproduces
+        # samples drawn in key order
+        workers = None
+    objects = iter_objects(
+        s3_client, bucket_name, prefix, page_limit,
+        pages=pages, delimiter=delimiter, workers=workers)
 
-    page_idx = 0
     all_keys = []
-    random_keys = []
-    still_more = True
+    delete_batch = []
     total_objects = 0
     total_size = 0
 
-    iterate = page_idx < pages and still_more if isinstance(
-        pages, int) else still_more
-
-    while iterate:
-        try:
-            current_page = next(piterator)
-        except StopIteration:
-            still_more = False
-        else:
-            if file_writer:
-                for item in current_page['Contents']:
-                    total_size += item['Size']
-                    if write_file_name_only:
-                        if file_stem_only:
-                            file_writer.write(fetch_filename_stem(
-                                ntpath.basename(item['Key'])))
-                        elif write_full_key:
-                            file_writer.write(item['Key'])
-                        else:
-                            file_writer.write(ntpath.basename(item['Key']))
-                    else:
-                        if compare_hash:
-                            file_writer.write('{}\t{}\t{}'.format(
-                                ntpath.basename(item['Key']),
-                                item['ETag'],
-                                item['Size']))
-                        else:
-                            file_writer.write('{}\t{}'.format(
-                                ntpath.basename(item['Key']),
-                                item['Size']))
-                    file_writer.write('\n')
-                    total_objects += 1
+    if pick_random:
+        weight = (lambda item: item['Size']) if weight_by_size else None
+        return [item['Key'] for item in reservoir_sample(
+            objects, random_size,
+            seed=random_seed, weight=weight)]
+
+    for item in objects:
+        total_objects += 1
+        total_size += item['Size']
+        if file_writer:
+            if write_file_name_only:
+                if file_stem_only:
+                    file_writer.write(fetch_filename_stem(
+                        ntpath.basename(item['Key'])))
+                elif write_full_key:
+                    file_writer.write(item['Key'])
+                else:
+                    file_writer.write(ntpath.basename(item['Key']))
             else:
-                tot_items = len(current_page['Contents'])
-                if pick_random:
-                    contents_array = numpy.array(current_page['Contents'])
-                    random_keys.append([item['Key'] for item in list(
-                        contents_array[numpy.random.choice(
-                            tot_items, size=random_size, replace=False)])])
+                if compare_hash:
+                    file_writer.write('{}\t{}\t{}'.format(
+                        ntpath.basename(item['Key']),
+                        item['ETag'],
+                        item['Size']))
                 else:
-                    total_objects += tot_items
-                    for item in current_page['Contents']:
-                        total_size += item['Size']
-                        if not count_only:
-                            all_keys.append(item['Key'])
-                        if delete_object:
-                            s3_client.delete_object(
-                                Bucket=bucket_name,
-                                Key=item['Key']
-                            )
-                            logger.debug('Deleted {}'.format(item['Key']))
-            page_idx += 1
-        iterate = page_idx < pages and still_more if isinstance(
-            pages, int) else still_more
+                    file_writer.write('{}\t{}'.format(
+                        ntpath.basename(item['Key']),
+                        item['Size']))
+            file_writer.write('\n')
+            continue
+        if not count_only:
+            all_keys.append(item['Key'])
+        if delete_object:
+            delete_batch.append(item['Key'])
+            if len(delete_batch) == 1000:
+                delete_keys(s3_client, bucket_name, delete_batch)
+                delete_batch = []
+
+    if delete_batch:
+        delete_keys(s3_client, bucket_name, delete_batch)
 
-    if pick_random:
-        # logger.debug(random_keys)
-        return list(chain.from_iterable(iter(random_keys)))
     if count_only:
         return total_objects, readable_size(total_size)
-    if not all_keys:
-        return all_keys, total_objects, total_size
-    return chain.from_iterable(all_keys), total_objects, total_size
+    return all_keys, total_objects, total_size
+
+
+# Hive types matching the Arrow types written by write_parquet
+PARQUET_TYPE_NAMES = {
+    'string': 'STRING',
+    'integer': 'BIGINT',
+    'number': 'DOUBLE',
+    'boolean': 'BOOLEAN',
+    'null': 'STRING',
+}
+
 
+def hive_type_name(schema_type):
+    return schema_type.upper()
 
-def generate_field_definitions(schema, level=0, odd_ones=None):
+
+def collapse_schema_type(schema_type):
+    if isinstance(schema_type, list):
+        if 'string' in schema_type:
+            return 'string'
+        elif 'object' in schema_type:
+            return 'object'
+    return schema_type
+
+
+def parquet_type_name(attributes):
+    """ Returns the Hive type of the column schema_to_arrow maps
+    attributes to, inline
+
+    """
+    schema_type = resolve_schema_type(attributes.get('type'))
+    if schema_type == 'object' and attributes.get('properties'):
+        return 'STRUCT<{}>'.format(', '.join(
+            '{}: {}'.format(name, parquet_type_name(nested))
+            for name, nested in attributes['properties'].items()))
+    if schema_type == 'array':
+        return 'ARRAY<{}>'.format(parquet_type_name(
+            attributes.get('xitems', {})))
+    return PARQUET_TYPE_NAMES.get(schema_type, 'STRING')
+
+
+def _parquet_field_layout(attributes):
+    # Same rules as _arrow_type, empty objects are stored as strings
+    field_type = resolve_schema_type(attributes.get('type'))
+    if field_type == 'object' and attributes.get('properties'):
+        return 'struct', attributes['properties'], None
+    if field_type == 'array':
+        items = attributes.get('xitems', {})
+        if resolve_schema_type(items.get('type')) == 'object' and \
+                items.get('properties'):
+            return 'array_struct', items['properties'], None
+        return 'array', None, parquet_type_name(items)
+    return 'scalar', None, parquet_type_name(attributes)
+
+
+def _field_layout(name, attributes, parquet=False):
+    """ Returns the cleaned name, kind, nested properties and Hive type of
+    a field, kind being one of struct, array_struct, array or scalar
+
+    """
     keywords = ['timestamp', 'date', 'datetime']
+    cleaned_name = "`{}`".format(
+        name) if name.lower() in keywords else name
+    if parquet:
+        return (cleaned_name,) + _parquet_field_layout(attributes)
+    field_type = collapse_schema_type(attributes['type'])
+    if field_type == 'object':
+        return cleaned_name, 'struct', attributes['properties'], None
+    if field_type == 'array':
+        items_type = collapse_schema_type(attributes['xitems']['type'])
+        if items_type == 'object':
+            return (cleaned_name, 'array_struct',
+                    attributes['xitems']['properties'], None)
+        return cleaned_name, 'array', None, hive_type_name(items_type)
+    return cleaned_name, 'scalar', None, hive_type_name(field_type)
+
+
+def _struct_shape_ids(schema, odd_ones, parquet):
+    """ Walks the schema bottom up, giving structs of identical shape the
+    same id, keyed by the id() of their properties
+
+    """
+    shape_ids = dict()
+    struct_ids = dict()
+    stack = [(schema, False)]
+    while stack:
+        properties, expanded = stack.pop()
+        if id(properties) in struct_ids:
+            continue
+        layouts = [(name, _field_layout(name, attributes, parquet))
+                   for name, attributes in properties.items()]
+        if not expanded:
+            stack.append((properties, True))
+            stack.extend((nested, False) for name, (
+                cleaned_name, kind, nested, type_name) in layouts if nested
+                is not None)
+            continue
+        shape = []
+        for name, (cleaned_name, kind, nested, type_name) in layouts:
+            if kind == 'scalar' and ':' in cleaned_name and \
+                    odd_ones is not None:
+                odd_ones.add(cleaned_name)
+            shape.append((name, kind, type_name if nested is None
+                          else struct_ids[id(nested)]))
+        struct_ids[id(properties)] = shape_ids.setdefault(
+            tuple(shape), len(shape_ids))
+    return struct_ids
+
+
+def generate_field_definitions(schema, level=0, odd_ones=None,
+                               parquet=False):
+    """ Renders the Hive column definitions of schema properties, with
+    parquet those of the columns schema_to_arrow maps them to
+
+    Walks the schema with an explicit stack, so deep schemas do not need
+    a raised recursion limit, leaves the schema untouched and builds the
+    output in a single list of parts. Structs of identical shape at the
+    same level are rendered once and their parts reused.
+
+    """
     tab = " "
-    type_separator = " " if level == 0 else ": "
-    field_separator = "\n" if level == 0 else ",\n"
-    field_definitions = []
-    new_level = level + 1
-    indentation = new_level * tab
-    for name, attributes in schema.items():
-        cleaned_name = "`{}`".format(
-            name) if name.lower() in keywords else name
-        if isinstance(attributes['type'], list):
-            if 'string' in attributes['type']:
-                attributes['type'] = 'string'
-            elif 'object' in attributes['type']:
-                attributes['type'] = 'object'
-        if attributes['type'] == 'object':
-            field_definitions.append(
-                "{indentation}{name}{separator}STRUCT<\n"
-                "{definitions}\n{indentation}>".format(
-                    indentation=indentation,
-                    name=cleaned_name,
-                    separator=type_separator,
-                    definitions=generate_field_definitions(
-                        attributes['properties'], new_level,
-                        odd_ones)
-                ))
-        elif attributes['type'] == 'array':
-            extra_indentation = (new_level + 1) * tab
-            if isinstance(attributes['xitems']['type'], list):
-                if 'string' in attributes['xitems']['type']:
-                    attributes['xitems']['type'] = 'string'
-                elif 'object' in attributes['xitems']['type']:
-                    attributes['xitems']['type'] = 'object'
-            if attributes['xitems']['type'] == 'object':
-                closing_bracket = "\n" + indentation + ">"
-                array_type = "STRUCT<\n{definitions}\n{indentation}>".format(
-                    indentation=extra_indentation,
-                    definitions=generate_field_definitions(
-                        attributes['xitems']['properties'], new_level + 1,
-                        odd_ones)
-                )
+    struct_ids = _struct_shape_ids(schema, odd_ones, parquet)
+    parts = []
+    rendered = dict()
+
+    stack = [('struct', schema, level)]
+    while stack:
+        action, value, argument = stack.pop()
+        if action == 'text':
+            parts.append(value)
+            continue
+        if action == 'mark':
+            rendered[value] = (argument, len(parts))
+            continue
+
+        struct_level = argument
+        struct_key = (struct_ids[id(value)], struct_level)
+        if struct_key in rendered:
+            start, end = rendered[struct_key]
+            parts.extend(parts[start:end])
+            continue
+
+        indentation = (struct_level + 1) * tab
+        type_separator = " " if struct_level == 0 else ": "
+        field_separator = "\n" if struct_level == 0 else ",\n"
+        actions = []
+        for idx, (name, attributes) in enumerate(value.items()):
+            cleaned_name, kind, nested, type_name = _field_layout(
+                name, attributes, parquet)
+            if idx:
+                actions.append(('text', field_separator, None))
+            head = indentation + cleaned_name + type_separator
+            if kind == 'struct':
+                actions.extend((
+                    ('text', head + "STRUCT<\n", None),
+                    ('struct', nested, struct_level + 1),
+                    ('text', "\n" + indentation + ">", None)))
+            elif kind == 'array_struct':
+                actions.extend((
+                    ('text', head + "ARRAY<STRUCT<\n", None),
+                    ('struct', nested, struct_level + 2),
+                    ('text', "\n" + (struct_level + 2) * tab + ">\n" +
+                     indentation + ">", None)))
+            elif kind == 'array':
+                actions.append(('text', head + "ARRAY<" + type_name + ">",
+                                None))
             else:
-                closing_bracket = ">"
-                array_type = attributes['xitems']['type'].upper()
-            field_definitions.append(
-                "{indentation}{name}{"
-                "separator}ARRAY<{definitions}{closing_bracket}".format(
-                    indentation=indentation,
-                    name=cleaned_name,
-                    separator=type_separator,
-                    definitions=array_type,
-                    closing_bracket=closing_bracket
-                ))
-        else:
-            if ':' in cleaned_name:
-                odd_ones.add(cleaned_name)
-            field_definitions.append("{indentation}"
-                                     "{name}{separator}{type}".format(
-                                         indentation=indentation,
-                                         name=cleaned_name,
-                                         separator=type_separator,
-                                         type=attributes['type'].upper()
-                                     ))
+                actions.append(('text', head + type_name, None))
+
+        stack.append(('mark', struct_key, len(parts)))
+        stack.extend(reversed(actions))
+
+    return ''.join(parts)
+
 
-    return field_separator.join(field_definitions)
+def get_date_partition_projection(first_year, last_year=2099):
+    """ Returns the partition projection of year=YYYY/month=MM/day=DD
+    partitions, first_year being that of the earliest data and last_year
+    far enough ahead for the table to outlive the data it describes
+
+    """
+    if first_year > last_year:
+        raise ValueError('first_year {} is after last_year {}'.format(
+            first_year, last_year))
+    return [
+        ('year', {'type': 'integer',
+                  'range': '{},{}'.format(first_year, last_year)}),
+        ('month', {'type': 'integer', 'range': '1,12', 'digits': '2'}),
+        ('day', {'type': 'integer', 'range': '1,31', 'digits': '2'}),
+    ]
+
+
+def get_partition_path(partitions):
+    """ Returns the Hive style key=value path of ordered (key, value)
+    partitions
+
+    """
+    return '/'.join('{}={}'.format(key, value) for key, value in partitions)
+
+
+def get_date_partitions(source, date):
+    return [
+        ('source', source),
+        ('year', date.strftime('%Y')),
+        ('month', date.strftime('%m')),
+        ('day', date.strftime('%d')),
+    ]
+
+
+def generate_partition_statements(partitions, data_location):
+    """ Returns the PARTITIONED BY clause and the partition projection
+    table properties for ordered (name, projection spec) partitions
+
+    """
+    if not partitions:
+        return '', []
+
+    partitioned_by = "\nPARTITIONED BY (\n{}\n)".format(",\n".join(
+        " {} STRING".format(name) for name, spec in partitions))
+
+    properties = [('projection.enabled', 'true')]
+    for name, spec in partitions:
+        properties.extend(
+            ('projection.{}.{}'.format(name, key), value)
+            for key, value in spec.items())
+    properties.append(('storage.location.template', '{}/{}'.format(
+        data_location.rstrip('/'), '/'.join(
+            '{0}=${{{0}}}'.format(name) for name, spec in partitions))))
+
+    return partitioned_by, properties
+
+
+def generate_table_properties(properties):
+    properties = [('has_encrypted_data', 'false')] + properties
+    if len(properties) == 1:
+        return "TBLPROPERTIES ('has_encrypted_data'='false')"
+    return "TBLPROPERTIES (\n{}\n)".format(",\n".join(
+        "  '{}'='{}'".format(key, value) for key, value in properties))
 
 
 def generate_json_table_statement(table, schema,
                                   data_location='',
-                                  database='default', managed=False):
+                                  database='default', managed=False,
+                                  partitions=None):
     odd_ones = set()
     field_definitions = generate_field_definitions(
         schema['properties'], 0, odd_ones)
     logger.debug('Odd Ones: {}'.format(list(odd_ones)))
     external_marker = "EXTERNAL " if not managed else ""
     location = "\nLOCATION '{}'".format(data_location) if not managed else ''
+    partitioned_by, properties = generate_partition_statements(
+        partitions, data_location)
     statement = """CREATE {external_marker}TABLE {table} (
 {field_definitions}
-)
+){partitioned_by}
 ROW FORMAT SERDE 'org.openx.data.jsonserde.JsonSerDe'
 STORED AS INPUTFORMAT 'org.apache.hadoop.mapred.TextInputFormat'
 OUTPUTFORMAT 'org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat'{location}
 WITH SERDEPROPERTIES (
   'serialization.format' = '1'
 )
-TBLPROPERTIES ('has_encrypted_data'='false')""".format(
+{table_properties}""".format(
         external_marker=external_marker,
         database=database,
         table=table,
         field_definitions=field_definitions,
-        location=location
+        partitioned_by=partitioned_by,
+        location=location,
+        table_properties=generate_table_properties(properties)
+    )
+    return statement
+
+
+def generate_parquet_table_statement(table, schema,
+                                     data_location='',
+                                     database='default', managed=False,
+                                     partitions=None):
+    odd_ones = set()
+    field_definitions = generate_field_definitions(
+        schema['properties'], 0, odd_ones, parquet=True)
+    logger.debug('Odd Ones: {}'.format(list(odd_ones)))
+    external_marker = "EXTERNAL " if not managed else ""
+    location = "\nLOCATION '{}'".format(data_location) if not managed else ''
+    partitioned_by, properties = generate_partition_statements(
+        partitions, data_location)
+    statement = """CREATE {external_marker}TABLE {table} (
+{field_definitions}
+){partitioned_by}
+STORED AS PARQUET{location}
+{table_properties}""".format(
+        external_marker=external_marker,
+        table=table,
+        field_definitions=field_definitions,
+        partitioned_by=partitioned_by,
+        location=location,
+        table_properties=generate_table_properties(properties)
     )
     return statement
 
 
+def resolve_schema_type(schema_type):
+    """ Collapses a union of types the way generate_field_definitions
+    does, string first then object, falling back to the widest of the
+    remaining types
+
+    """
+    if not isinstance(schema_type, list):
+        return schema_type
+    for candidate in ('string', 'object', 'array', 'number', 'integer',
+                      'boolean'):
+        if candidate in schema_type:
+            return candidate
+    return 'null'
+
+
+def _arrow_type(attributes):
+    schema_type = resolve_schema_type(attributes.get('type'))
+    if schema_type == 'object':
+        fields = _arrow_fields(attributes.get('properties', {}))
+        return pyarrow.struct(fields) if fields else pyarrow.string()
+    if schema_type == 'array':
+        return pyarrow.list_(_arrow_type(attributes.get('xitems', {})))
+    if schema_type == 'integer':
+        return pyarrow.int64()
+    if schema_type == 'number':
+        return pyarrow.float64()
+    if schema_type == 'boolean':
+        return pyarrow.bool_()
+    return pyarrow.string()
+
+
+def _arrow_fields(properties):
+    return [pyarrow.field(name, _arrow_type(attributes))
+            for name, attributes in properties.items()]
+
+
+def schema_to_arrow(schema):
+    """ Maps an inferred genson schema to an Arrow schema
+
+    Objects become structs and arrays lists. Empty objects and nulls are
+    stored as strings, matching PARQUET_TYPE_NAMES.
+
+    """
+    if pyarrow is None:
+        raise ImportError('pyarrow is required for parquet output')
+    return pyarrow.schema(_arrow_fields(schema.get('properties', {})))
+
+
+def coerce_to_arrow(value, arrow_type):
+    """ Fits a parsed JSON value to an Arrow type, values of a losing
+    union type being kept as JSON text in string columns
+
+    """
+    if value is None:
+        return None
+    if pyarrow.types.is_struct(arrow_type):
+        if not isinstance(value, dict):
+            return None
+        return {field.name: coerce_to_arrow(value.get(field.name),
+                                            field.type)
+                for field in arrow_type}
+    if pyarrow.types.is_list(arrow_type):
+        if not isinstance(value, list):
+            value = [value]
+        return [coerce_to_arrow(item, arrow_type.value_type)
+                for item in value]
+    if pyarrow.types.is_string(arrow_type):
+        if isinstance(value, str):
+            return value
+        return rapidjson.dumps(value, number_mode=rapidjson.NM_DECIMAL)
+    if pyarrow.types.is_floating(arrow_type):
+        return float(value) if isinstance(
+            value, (int, float, Decimal)) else None
+    if pyarrow.types.is_integer(arrow_type):
+        return int(value) if isinstance(
+            value, (int, float, Decimal)) else None
+    if pyarrow.types.is_boolean(arrow_type):
+        return value if isinstance(value, bool) else None
+    return value
+
+
+def arrow_row(json_object, arrow_schema):
+    return {field.name: coerce_to_arrow(json_object.get(field.name),
+                                        field.type)
+            for field in arrow_schema}
+
+
+def write_parquet(json_objects, fpath, arrow_schema):
+    rows = [arrow_row(json_object, arrow_schema)
+            for json_object in json_objects]
+    table = pyarrow.Table.from_pylist(rows, schema=arrow_schema)
+    pyarrow.parquet.write_table(table, fpath)
+
+
 def infer_schema(json_objects):
     s = genson.Schema()
     s.add_schema({"type": "object", "properties": {}})
@@ -513,7 +2239,101 @@ def infer_schema(json_objects):
     return s.to_dict()
 
 
+def merge_schemas(schemas):
+    """ Merges partial schemas, e.g. inferred per file or per shard,
+    into a single schema
+
+    """
+    s = genson.Schema()
+    s.add_schema({"type": "object", "properties": {}})
+    for schema in schemas:
+        s.add_schema(schema)
+    return s.to_dict()
+
+
+def iter_json_lines(json_file_path):
+    with open_compressed(json_file_path, 'rt') as f:
+        for line in f:
+            yield json_loads(line)
+
+
 def infer_schema_from_file(json_file_path):
-    with open(json_file_path, 'r') as f:
-        objects = [rapidjson.loads(line) for line in f.readlines()]
-    return infer_schema(objects)
+    return infer_schema(iter_json_lines(json_file_path))
+
+
+def get_file_signature(fpath):
+    stat = os.stat(fpath)
+    return os.path.abspath(fpath), stat.st_size, stat.st_mtime_ns
+
+
+@functools.lru_cache(maxsize=4096)
+def _cached_file_schema(fpath, size, mtime_ns, json_lines, cache_dir):
+    cache_path = None
+    if cache_dir:
+        cache_key = hashlib.sha1(rapidjson.dumps(
+            [fpath, size, mtime_ns, json_lines]).encode('utf-8')).hexdigest()
+        cache_path = os.path.join(
+            cache_dir, cache_key[:2], '{}.json'.format(cache_key))
+        if os.path.exists(cache_path):
+            return read_json(cache_path)
+
+    schema = infer_schema_from_file(fpath) if json_lines else infer_schema(
+        [read_json(fpath)])
+
+    if cache_path:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+        with os.fdopen(fd, 'w') as fp:
+            rapidjson.dump(schema, fp)
+        os.replace(temp_path, cache_path)
+
+    return schema
+
+
+def get_file_schema(fpath, json_lines=True, cache_dir=SCHEMA_CACHE_DIR):
+    """ Returns the inferred schema of a file
+
+    Results are cached in memory and, with a cache_dir, on disk, keyed
+    by path, size and mtime so that unchanged files are never inferred
+    twice. The returned schema is shared, do not mutate it.
+
+    """
+    return _cached_file_schema(
+        *get_file_signature(fpath), json_lines, cache_dir)
+
+
+def infer_schema_from_files(fpaths, cache_dir=None):
+    """ Infers the schema of JSON documents, one per file, holding only
+    one document in memory at a time
+
+    With a cache_dir, per file schemas are taken from the schema cache
+    and merged, so that inferring the same files again, as main() of
+    json_standardize does, costs no parsing.
+
+    """
+    if cache_dir:
+        return merge_schemas(get_file_schema(
+            fpath, json_lines=False, cache_dir=cache_dir)
+            for fpath in fpaths)
+    return infer_schema(read_json(fpath) for fpath in fpaths)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def infer_schema_parallel(fpaths, workers, shard_size=256, cache_dir=None):
+    """ Infers a partial schema per shard of files over a process pool
+    and merges them
+
+    Memory per worker is bounded by the largest single document.
+
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return merge_schemas(executor.map(
+            functools.partial(infer_schema_from_files, cache_dir=cache_dir),
+            chunked(fpaths, shard_size)))
@@ -0,0 +1,63 @@
+from shared import iter_archive, zip_extractor
+import tarfile
+import zipfile
+import gzip
+import io
+import os
+
+
+def zip_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as outzip:
+        for name, data in members.items():
+            outzip.writestr(name, data)
+    return buffer.getvalue()
+
+
+def tar_gz_bytes(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as outtar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            outtar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_zip_extractor_only_descends_into_zip_files(tmp_path):
+    docx = zip_bytes({'word/document.xml': b'<?xml version="1.0"?>'})
+    outer = tmp_path / 'outer.zip'
+    outer.write_bytes(zip_bytes({
+        'report.docx': docx,
+        'nested/inner.zip': zip_bytes({'a.json': b'{"a": 1}'}),
+        'data.json': b'{"b": 2}',
+        '../escape.json': b'{}',
+    }))
+    out_dir = tmp_path / 'out'
+
+    zip_extractor(str(outer), str(out_dir), workers=2)
+
+    extracted = sorted(os.path.relpath(os.path.join(root, fname),
+                                       str(out_dir))
+                       for root, _, fnames in os.walk(str(out_dir))
+                       for fname in fnames)
+    assert extracted == ['a.json', 'data.json', 'escape.json',
+                         'report.docx']
+    assert (out_dir / 'report.docx').read_bytes() == docx
+    assert (out_dir / 'a.json').read_bytes() == b'{"a": 1}'
+    assert not outer.exists()
+
+
+def test_iter_archive_walks_nested_archives(tmp_path):
+    archive = tmp_path / 'batch.zip'
+    archive.write_bytes(zip_bytes({
+        'docs.tar.gz': tar_gz_bytes({'x.json': b'{"x": 1}'}),
+        'y.json.gz': gzip.compress(b'{"y": 2}'),
+        'z.json': b'{"z": 3}',
+    }))
+
+    members = {name: member.read()
+               for name, member in iter_archive(str(archive))}
+
+    assert members == {'x.json': b'{"x": 1}', 'y.json': b'{"y": 2}',
+                       'z.json': b'{"z": 3}'}
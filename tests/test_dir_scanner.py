@@ -0,0 +1,66 @@
+from shared import DirScanner, dir_traverse
+import os
+
+
+def make_tree(root):
+    files = {
+        'a.json': b'{"a": 1}',
+        'b.xml': b'<?xml version="1.0"?><b/>',
+        '.hidden.json': b'{}',
+        'notes.txt': b'not json',
+        'sub/c.json': b'{"c": 3}',
+        'sub/deeper/d.json': b'  {"d": 4}',
+        'sub/deeper/e.json': b'{"e": 5}',
+        'sub2/f.json': b'{}',
+        '.git/g.json': b'{}',
+        'empty.json': b'',
+    }
+    for name, data in files.items():
+        fpath = os.path.join(root, name)
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        with open(fpath, 'wb') as fp:
+            fp.write(data)
+    os.symlink(os.path.join(root, 'sub'), os.path.join(root, 'link'))
+    return files
+
+
+def walked(root):
+    return [os.path.join(dirpath, fname)
+            for dirpath, _, fnames in os.walk(root) for fname in fnames]
+
+
+def test_lists_files_in_os_walk_order(tmp_path):
+    root = str(tmp_path)
+    make_tree(root)
+
+    assert [entry.path for entry in DirScanner(root)] == walked(root)
+    assert list(dir_traverse(root)) == walked(root)
+
+
+def test_filters(tmp_path):
+    root = str(tmp_path)
+    make_tree(root)
+
+    def scanned(**kwargs):
+        return sorted(os.path.relpath(fpath, root)
+                      for fpath in dir_traverse(root, **kwargs))
+
+    assert scanned(include_hidden=False, extensions='.json') == [
+        'a.json', 'empty.json', 'sub/c.json', 'sub/deeper/d.json',
+        'sub/deeper/e.json', 'sub2/f.json']
+    assert scanned(include_hidden=False, fileformat='json') == [
+        'a.json', 'sub/c.json', 'sub/deeper/e.json', 'sub2/f.json']
+    assert scanned(fileformat='xml') == ['b.xml']
+    assert scanned(extensions=('.xml', '.txt')) == ['b.xml', 'notes.txt']
+
+
+def test_totals_and_workers(tmp_path):
+    root = str(tmp_path)
+    files = make_tree(root)
+
+    scanner = DirScanner(root, totals=True, workers=4)
+    fpaths = sorted(entry.path for entry in scanner)
+
+    assert fpaths == sorted(walked(root))
+    assert scanner.total_files == len(files)
+    assert scanner.total_size == sum(len(data) for data in files.values())
@@ -0,0 +1,130 @@
+from shared import generate_field_definitions
+import random
+import copy
+import pytest
+
+
+def reference_field_definitions(schema, level=0, odd_ones=None):
+    """ The recursive generate_field_definitions the iterative one
+    replaced, kept to check that both render the same DDL
+
+    """
+    keywords = ['timestamp', 'date', 'datetime']
+    tab = " "
+    type_separator = " " if level == 0 else ": "
+    field_separator = "\n" if level == 0 else ",\n"
+    field_definitions = []
+    new_level = level + 1
+    indentation = new_level * tab
+    for name, attributes in schema.items():
+        cleaned_name = "`{}`".format(
+            name) if name.lower() in keywords else name
+        if isinstance(attributes['type'], list):
+            if 'string' in attributes['type']:
+                attributes['type'] = 'string'
+            elif 'object' in attributes['type']:
+                attributes['type'] = 'object'
+        if attributes['type'] == 'object':
+            field_definitions.append(
+                "{indentation}{name}{separator}STRUCT<\n"
+                "{definitions}\n{indentation}>".format(
+                    indentation=indentation,
+                    name=cleaned_name,
+                    separator=type_separator,
+                    definitions=reference_field_definitions(
+                        attributes['properties'], new_level,
+                        odd_ones)
+                ))
+        elif attributes['type'] == 'array':
+            extra_indentation = (new_level + 1) * tab
+            if isinstance(attributes['xitems']['type'], list):
+                if 'string' in attributes['xitems']['type']:
+                    attributes['xitems']['type'] = 'string'
+                elif 'object' in attributes['xitems']['type']:
+                    attributes['xitems']['type'] = 'object'
+            if attributes['xitems']['type'] == 'object':
+                closing_bracket = "\n" + indentation + ">"
+                array_type = "STRUCT<\n{definitions}\n{indentation}>".format(
+                    indentation=extra_indentation,
+                    definitions=reference_field_definitions(
+                        attributes['xitems']['properties'], new_level + 1,
+                        odd_ones)
+                )
+            else:
+                closing_bracket = ">"
+                array_type = attributes['xitems']['type'].upper()
+            field_definitions.append(
+                "{indentation}{name}{"
+                "separator}ARRAY<{definitions}{closing_bracket}".format(
+                    indentation=indentation,
+                    name=cleaned_name,
+                    separator=type_separator,
+                    definitions=array_type,
+                    closing_bracket=closing_bracket
+                ))
+        else:
+            if ':' in cleaned_name:
+                odd_ones.add(cleaned_name)
+            field_definitions.append("{indentation}"
+                                     "{name}{separator}{type}".format(
+                                         indentation=indentation,
+                                         name=cleaned_name,
+                                         separator=type_separator,
+                                         type=attributes['type'].upper()
+                                     ))
+
+    return field_separator.join(field_definitions)
+
+
+NAMES = ['id', 'name', 'date', 'Timestamp', 'ns:tag', 'text', 'value']
+SCALARS = ['string', 'integer', 'number', 'boolean', 'null']
+
+
+def make_properties(rng, depth):
+    return {name: make_node(rng, depth + 1)
+            for name in rng.sample(NAMES, rng.randint(1, 4))}
+
+
+def make_node(rng, depth):
+    kinds = ['scalar', 'mixed', 'object', 'array'] if depth < 5 else [
+        'scalar', 'mixed']
+    kind = rng.choice(kinds)
+    if kind == 'scalar':
+        return {'type': rng.choice(SCALARS)}
+    if kind == 'mixed':
+        return {'type': ['integer', 'string']}
+    if kind == 'object':
+        return {'type': rng.choice(['object', ['null', 'object']]),
+                'properties': make_properties(rng, depth)}
+    return {'type': 'array', 'xitems': make_node(rng, depth)
+            if rng.random() < 0.8 else {
+                'type': ['object', 'integer'],
+                'properties': make_properties(rng, depth)}}
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_matches_the_recursive_definitions(seed):
+    rng = random.Random(seed)
+    properties = make_properties(rng, 0)
+    expected_odd_ones, odd_ones = set(), set()
+
+    expected = reference_field_definitions(
+        copy.deepcopy(properties), 0, expected_odd_ones)
+
+    assert generate_field_definitions(properties, 0, odd_ones) == expected
+    assert odd_ones == expected_odd_ones
+
+
+def test_deeply_nested_structs():
+    properties = node = {}
+    for level in range(2000):
+        node['child'] = {'type': 'object', 'properties': {}}
+        node = node['child']['properties']
+    node['leaf'] = {'type': 'string'}
+
+    definitions = generate_field_definitions(properties, 0, set())
+
+    assert definitions.count('STRUCT<') == 2000
+    assert definitions.endswith('leaf: STRING\n' + ' ' * 2000 + '>' +
+                                ''.join('\n{}>'.format(' ' * level)
+                                        for level in range(1999, 0, -1)))
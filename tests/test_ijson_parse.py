@@ -0,0 +1,45 @@
+from shared import ijson_parse, ARRAY_ITEM, json_dumps
+import ijson
+import random
+import pytest
+import io
+
+
+def parse(data):
+    return list(ijson_parse(io.BytesIO(data)))
+
+
+def test_keys_named_item_are_kept():
+    events = parse(b'{"item": "x", "a": [{"item": [1]}], "b": {"item": 2}}')
+
+    assert [prefix for prefix, event, _ in events
+            if event in ('string', 'number')] == [
+        'item', 'a.xitem.item.xitem', 'b.item']
+    assert ('a.xitem', 'map_key', 'item') in events
+    assert ('a.xitem.item', 'start_array', None) in events
+
+
+def make_value(rng, depth):
+    kind = rng.choice(['object', 'array', 'scalar'] if depth < 4 else [
+        'scalar'])
+    if kind == 'object':
+        return {rng.choice(['a', 'b.c', '', 'é']): make_value(rng, depth + 1)
+                for _ in range(rng.randint(0, 3))}
+    if kind == 'array':
+        return [make_value(rng, depth + 1) for _ in range(rng.randint(0, 3))]
+    return rng.choice(['s', 1, 2.5, True, None])
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_matches_ijson_parse(seed):
+    rng = random.Random(seed)
+    data = json_dumps(make_value(rng, 0))
+    item = list(ijson.parse(io.BytesIO(b'[0]')))[1][0]
+
+    # Without keys named like array items, renaming every component
+    # gives the expected prefixes
+    expected = [('.'.join(ARRAY_ITEM if key == item else key
+                          for key in prefix.split('.')), event, value)
+                for prefix, event, value in ijson.parse(io.BytesIO(data))]
+
+    assert parse(data) == expected
@@ -0,0 +1,97 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from parse_it import ingest, report_dates, report_urls, parser
+import threading
+import datetime
+import pytest
+import csv
+import os
+
+
+REPORT = '''<html><body><pre>
+WHEAT-SRW - CHICAGO BOARD OF TRADE                   Code-001602
+FUTURES ONLY POSITIONS AS OF 01/02/18
+                                   OPEN INTEREST:      459,123
+CORN - CHICAGO BOARD OF TRADE                        Code-002602
+FUTURES ONLY POSITIONS AS OF 01/02/18
+                                   OPEN INTEREST:    1,482,017
+</pre></body></html>
+'''
+
+ROWS = [['WHEAT-SRW - CHICAGO BOARD OF TRADE', '459123'],
+        ['CORN - CHICAGO BOARD OF TRADE', '1482017']]
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    # Paths the fixture server has no report for
+    missing = ('dea/cotarchives/2018/futures/deacbtsf010918.htm',)
+
+    def do_GET(self):
+        if not self.path.endswith('.htm') or self.path.endswith(
+                self.missing):
+            self.send_error(404)
+            return
+        body = REPORT.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ReportHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def read_rows(fpath):
+    with open(fpath, newline='') as fp:
+        return list(csv.reader(fp))
+
+
+def test_parses_a_report(base_url):
+    url = '{}/dea/futures/deacbtsf.htm'.format(base_url)
+
+    assert parser(url).splitlines() == [
+        'contract,open_interest'] + [','.join(row) for row in ROWS]
+
+
+def test_ingests_reports_into_partitions(tmp_path, base_url):
+    dates = list(report_dates(datetime.date(2018, 1, 1),
+                              datetime.date(2018, 1, 10)))
+    reports = list(report_urls(['cbt', 'nyme'], dates, base_url))
+
+    output_paths = ingest(reports, str(tmp_path), workers=4)
+
+    assert dates == [datetime.date(2018, 1, 2), datetime.date(2018, 1, 9)]
+    # The 2018-01-09 cbt report is missing and skipped
+    assert sorted(os.path.relpath(fpath, str(tmp_path))
+                  for fpath in output_paths) == [
+        'exchange=cbt/report_date=2018-01-02/part-0.csv',
+        'exchange=nyme/report_date=2018-01-02/part-0.csv',
+        'exchange=nyme/report_date=2018-01-09/part-0.csv',
+    ]
+    for fpath in output_paths:
+        assert read_rows(fpath) == [['contract', 'open_interest']] + ROWS
+
+
+def test_ingests_latest_reports_as_parquet(tmp_path, base_url):
+    pandas = pytest.importorskip('pandas')
+    pytest.importorskip('pyarrow')
+    reports = list(report_urls(['cmx'], base_url=base_url))
+
+    output_paths = ingest(reports, str(tmp_path), output_format='parquet')
+
+    assert [os.path.relpath(fpath, str(tmp_path))
+            for fpath in output_paths] == [
+        'exchange=cmx/report_date=latest/part-0.parquet']
+    frame = pandas.read_parquet(output_paths[0])
+    assert frame.values.tolist() == [[contract, int(open_interest)]
+                                     for contract, open_interest in ROWS]
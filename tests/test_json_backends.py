@@ -0,0 +1,56 @@
+from shared import select_json_backend, JSON_BACKENDS
+import shared
+from decimal import Decimal
+import pytest
+import json
+
+
+DOCUMENT = {
+    'small': Decimal('0.1000000000000000000001'),
+    'large': Decimal('1E+400'),
+    'trailing': Decimal('1.10'),
+    'wide': 2 ** 70,
+    'plain': [1, 2.5, 'é', None, True],
+}
+
+
+@pytest.mark.parametrize('name', JSON_BACKENDS)
+def test_dumps_numbers_exactly(name):
+    backend, loads, dumps = select_json_backend([name])
+    if backend != name:
+        pytest.skip('{} is not installed'.format(name))
+
+    data = dumps(DOCUMENT)
+
+    assert json.loads(data, parse_float=Decimal) == DOCUMENT
+    assert b'1.10' in data
+    assert loads(dumps({'wide': 2 ** 70})) == {'wide': 2 ** 70}
+
+
+def test_orjson_dumps_decimals_in_one_pass(monkeypatch):
+    orjson = pytest.importorskip('orjson')
+    if not hasattr(orjson, 'Fragment'):
+        pytest.skip('orjson.Fragment needs orjson 3.9')
+
+    def rapidjson_dumps(obj):
+        raise AssertionError('serialised twice')
+
+    monkeypatch.setattr(shared, '_rapidjson_dumps', rapidjson_dumps)
+
+    assert shared._orjson_dumps({'n': Decimal('1.10')}) == b'{"n":1.10}'
+
+
+@pytest.mark.parametrize('name', JSON_BACKENDS)
+@pytest.mark.parametrize('data', [
+    b'{"n": 18446744073709551616}',
+    b'{"n": -9223372036854775809}',
+    b'{"n": 18446744073709551615, "s": "12345678901234567890"}',
+    b'[-9223372036854775808, 9999999999999999999]',
+])
+def test_loads_integers_exactly(name, data):
+    backend, loads, dumps = select_json_backend([name])
+    if backend != name:
+        pytest.skip('{} is not installed'.format(name))
+
+    # Floats compare equal to the integers they round, reprs do not
+    assert repr(loads(data)) == repr(json.loads(data))
@@ -0,0 +1,54 @@
+from shared import list_dir
+import pytest
+
+
+@pytest.fixture
+def keys(s3_client):
+    keys = sorted('data/{}/doc-{:03d}.json'.format(sub_prefix, idx)
+                  for sub_prefix in ('a', 'b', 'c', 'd')
+                  for idx in range(30))
+    keys.append('data/top.json')
+    for key in keys:
+        s3_client.put_object(Bucket='datalake', Key=key, Body=b'{}')
+    return sorted(keys)
+
+
+@pytest.mark.parametrize('workers', [None, 4])
+def test_lists_every_key(s3_client, keys, workers):
+    all_keys, total_objects, total_size = list_dir(
+        s3_client, 'datalake', 'data/', 10, workers=workers)
+
+    assert sorted(all_keys) == keys
+    assert total_objects == len(keys)
+    assert total_size == 2 * len(keys)
+
+
+def test_counts_only(s3_client, keys):
+    assert list_dir(s3_client, 'datalake', 'data/', 10, count_only=True,
+                    workers=4) == (len(keys), '242 bytes')
+
+
+def test_stops_after_pages(s3_client, keys):
+    all_keys, total_objects, _ = list_dir(
+        s3_client, 'datalake', 'data/', 10, pages=2)
+
+    assert all_keys == keys[:20]
+
+
+@pytest.mark.parametrize('workers', [None, 4])
+def test_seeded_sample_is_reproducible(s3_client, keys, workers):
+    samples = [list_dir(s3_client, 'datalake', 'data/', 10,
+                        pick_random=True, random_size=5, random_seed=7,
+                        workers=workers) for _ in range(5)]
+
+    assert len(set(samples[0])) == 5
+    assert set(samples[0]) <= set(keys)
+    assert all(sample == samples[0] for sample in samples)
+
+
+def test_deletes_listed_keys(s3_client, keys):
+    list_dir(s3_client, 'datalake', 'data/a/', 10, delete_object=True)
+
+    remaining, _, _ = list_dir(s3_client, 'datalake', 'data/', 10)
+    assert sorted(remaining) == [key for key in keys
+                                 if not key.startswith('data/a/')]
@@ -0,0 +1,46 @@
+from shared import get_logger
+import shared
+import logging
+import uuid
+
+
+def logger_name(tmp_path):
+    return str(tmp_path / '{}.py'.format(uuid.uuid4().hex))
+
+
+def test_level_names_in_any_case(tmp_path):
+    xlogger = get_logger(logger_name(tmp_path), level='info')
+
+    assert xlogger.level == logging.INFO
+    assert xlogger.handlers[0].level == logging.INFO
+
+
+def test_configured_once(tmp_path):
+    name = logger_name(tmp_path)
+    xlogger = get_logger(name, level='WARNING')
+
+    assert get_logger(name, level='DEBUG') is xlogger
+    assert xlogger.level == logging.WARNING
+    assert len(xlogger.handlers) == 1
+
+
+def test_queued_records_are_formatted_when_logged(tmp_path):
+    xlogger = get_logger(logger_name(tmp_path),
+                         log_file=str(tmp_path / 'queued.log'),
+                         level=logging.DEBUG, queued=True)
+    queue_handler = xlogger.handlers[0]
+    listener = next(listener for _, handler, _, listener in
+                    shared._queued_loggers if handler is queue_handler)
+    # Holds records in the queue
+    listener.stop()
+    items = ['first']
+
+    try:
+        xlogger.debug('items: %s', items)
+        items.append('second')
+        record = queue_handler.queue.get_nowait()
+    finally:
+        listener.start()
+
+    assert record.msg == "items: ['first']"
+    assert not record.args
@@ -0,0 +1,110 @@
+from json_standardize import transform
+from shared import TransformManifest
+import sqlite3
+import os
+
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'note': {'type': ['object', 'string'],
+                 'properties': {'text': {'type': 'string'}}},
+        'title': {'type': 'string'},
+    },
+}
+
+RETYPED_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'note': {'type': 'string'},
+        'title': {'type': ['object', 'string'],
+                  'properties': {'text': {'type': 'string'}}},
+    },
+}
+
+
+def write_source(tmp_path):
+    source_dir = tmp_path / 'source'
+    source_dir.mkdir()
+    (source_dir / 'doc.json').write_text('{"note": "n", "title": "t"}')
+    return str(source_dir)
+
+
+def run(tmp_path, s3_client, schema, s3_base='base'):
+    source_dir = tmp_path / 'source'
+    if not source_dir.exists():
+        write_source(tmp_path)
+    transform(str(source_dir), str(tmp_path / 'dest'), schema, s3_client,
+              'datalake', s3_base, incremental=True)
+    return s3_client.get_object(
+        Bucket='datalake', Key='{}/doc.json'.format(s3_base))['Body'].read()
+
+
+def test_is_unchanged(tmp_path):
+    fpath = tmp_path / 'doc.json'
+    fpath.write_text('{"a": 1}')
+    manifest = TransformManifest(str(tmp_path / 'manifest.sqlite'))
+
+    assert not manifest.is_unchanged(str(fpath), fingerprint='f')
+    manifest.record(str(fpath), 'base/doc.json', 'etag', fingerprint='f')
+
+    assert manifest.is_unchanged(str(fpath), fingerprint='f',
+                                 s3_key='base/doc.json')
+    assert not manifest.is_unchanged(str(fpath), fingerprint='g')
+    assert not manifest.is_unchanged(str(fpath), fingerprint='f',
+                                     s3_key='other/doc.json')
+
+    # Touched but identical files are hashed and kept
+    os.utime(str(fpath), ns=(0, 0))
+    assert manifest.is_unchanged(str(fpath), fingerprint='f')
+    assert manifest.get(str(fpath)).mtime_ns == 0
+
+    fpath.write_text('{"a": 2}')
+    assert not manifest.is_unchanged(str(fpath), fingerprint='f')
+    manifest.close()
+
+
+def test_manifests_without_fingerprints_are_upgraded(tmp_path):
+    path = str(tmp_path / 'manifest.sqlite')
+    connection = sqlite3.connect(path)
+    connection.execute(
+        'CREATE TABLE manifest (source_path TEXT PRIMARY KEY, size INTEGER,'
+        ' mtime_ns INTEGER, sha256 TEXT, s3_key TEXT, etag TEXT,'
+        ' updated_at TEXT)')
+    connection.execute(
+        "INSERT INTO manifest VALUES ('/doc.json', 1, 1, 'h', 'k', 'e', '')")
+    connection.commit()
+    connection.close()
+
+    manifest = TransformManifest(path)
+
+    assert manifest.get('/doc.json').fingerprint is None
+    manifest.close()
+
+
+def test_transform_skips_unchanged_files(tmp_path, s3_client):
+    assert run(tmp_path, s3_client, SCHEMA) == \
+        b'{"note":{"text":["n"]},"title":"t"}'
+    s3_client.delete_object(Bucket='datalake', Key='base/doc.json')
+
+    transform(str(tmp_path / 'source'), str(tmp_path / 'dest'), SCHEMA,
+              s3_client, 'datalake', 'base', incremental=True)
+
+    # Skipped, so not uploaded again
+    resp = s3_client.list_objects_v2(Bucket='datalake', Prefix='base/')
+    assert resp['KeyCount'] == 0
+
+
+def test_transform_redoes_files_when_the_schema_changes(tmp_path, s3_client):
+    run(tmp_path, s3_client, SCHEMA)
+
+    assert run(tmp_path, s3_client, RETYPED_SCHEMA) == \
+        b'{"note":"n","title":{"text":["t"]}}'
+
+
+def test_transform_redoes_files_when_the_destination_changes(
+        tmp_path, s3_client):
+    run(tmp_path, s3_client, SCHEMA)
+
+    assert run(tmp_path, s3_client, SCHEMA, s3_base='moved') == \
+        b'{"note":{"text":["n"]},"title":"t"}'
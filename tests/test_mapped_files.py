@@ -0,0 +1,78 @@
+from shared import MappedFiles
+import mmap
+import os
+
+
+def write(fpath, data):
+    with open(fpath, 'wb') as fp:
+        fp.write(data)
+    return str(fpath)
+
+
+def test_readers_share_one_mapping(tmp_path):
+    fpath = write(tmp_path / 'doc.json', b'{"a": 1}')
+    mapped = MappedFiles()
+
+    with mapped.reader(fpath) as first, mapped.reader(fpath) as second:
+        assert first.read(4) == b'{"a"'
+        assert second.read() == b'{"a": 1}'
+        assert first.read() == b': 1}'
+        assert first.view.obj is second.view.obj
+    assert len(mapped.maps) == 1
+
+    mapped.close()
+    assert not mapped.maps
+
+
+def test_changed_files_are_mapped_again(tmp_path):
+    fpath = write(tmp_path / 'doc.json', b'{"a": 1}')
+    mapped = MappedFiles()
+    with mapped.open(fpath) as buffer:
+        assert buffer[:] == b'{"a": 1}'
+
+    write(fpath, b'{"a": 22}')
+    with mapped.open(fpath) as buffer:
+        assert buffer[:] == b'{"a": 22}'
+    assert len(mapped.maps) == 2
+    mapped.close()
+
+
+def test_least_recently_used_mappings_beyond_max_open_are_closed(
+        tmp_path):
+    mapped = MappedFiles(max_open=2)
+    buffers = []
+    for idx in range(4):
+        fpath = write(tmp_path / '{}.json'.format(idx), b'{}')
+        with mapped.open(fpath) as buffer:
+            buffers.append(buffer)
+
+    assert [buffer.closed for buffer in buffers] == [
+        True, True, False, False]
+    assert len(mapped.maps) == 2
+    mapped.close()
+    assert all(buffer.closed for buffer in buffers)
+
+
+def test_mappings_in_use_stay_open(tmp_path):
+    mapped = MappedFiles(max_open=0)
+    first = write(tmp_path / 'first.json', b'{"first": 1}')
+    second = write(tmp_path / 'second.json', b'{"second": 2}')
+
+    with mapped.open(first) as buffer:
+        with mapped.open(second):
+            pass
+        mapped.close()
+        assert isinstance(buffer, mmap.mmap) and not buffer.closed
+        assert buffer[:] == b'{"first": 1}'
+    assert not mapped.maps
+    assert buffer.closed
+
+
+def test_empty_files(tmp_path):
+    fpath = write(tmp_path / 'empty.json', b'')
+    mapped = MappedFiles()
+
+    with mapped.reader(fpath) as reader:
+        assert reader.read() == b''
+    mapped.close()
+    assert os.path.exists(fpath)
@@ -0,0 +1,88 @@
+from json_standardize import transform
+from shared import (
+    generate_parquet_table_statement,
+    parquet_type_name,
+    schema_to_arrow
+)
+import pytest
+
+pyarrow = pytest.importorskip('pyarrow')
+pytest.importorskip('pyarrow.parquet')
+
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'id': {'type': ['integer', 'null']},
+        'meta': {'type': 'object', 'properties': {}},
+        'tags': {'type': ['array', 'null'],
+                 'xitems': {'type': ['string', 'null']}},
+        'empty': {'type': 'array'},
+        'grid': {'type': 'array', 'xitems': {
+            'type': 'array', 'xitems': {
+                'type': 'object',
+                'properties': {'x': {'type': 'number'}}}}},
+        'doc': {'type': ['object', 'null'], 'properties': {
+            'a': {'type': ['integer', 'number']},
+            'b': {'type': 'array', 'xitems': {
+                'type': 'object',
+                'properties': {'c': {'type': 'boolean'}}}}}},
+    },
+}
+
+
+def hive_type(arrow_type):
+    if pyarrow.types.is_struct(arrow_type):
+        return 'STRUCT<{}>'.format(', '.join(
+            '{}: {}'.format(field.name, hive_type(field.type))
+            for field in arrow_type))
+    if pyarrow.types.is_list(arrow_type):
+        return 'ARRAY<{}>'.format(hive_type(arrow_type.value_type))
+    return {
+        pyarrow.int64(): 'BIGINT',
+        pyarrow.float64(): 'DOUBLE',
+        pyarrow.bool_(): 'BOOLEAN',
+        pyarrow.string(): 'STRING',
+    }[arrow_type]
+
+
+def test_column_types_match_the_arrow_schema():
+    arrow_schema = schema_to_arrow(SCHEMA)
+
+    assert {name: parquet_type_name(attributes)
+            for name, attributes in SCHEMA['properties'].items()} == {
+        field.name: hive_type(field.type) for field in arrow_schema}
+
+
+def test_renders_nullable_and_empty_columns():
+    statement = generate_parquet_table_statement('docs', SCHEMA)
+    columns = ' '.join(statement.split('(\n', 1)[1].split('\n)')[0].split())
+
+    assert columns == (
+        'id BIGINT meta STRING tags ARRAY<STRING> empty ARRAY<STRING> '
+        'grid ARRAY<ARRAY<STRUCT<x: DOUBLE>>> '
+        'doc STRUCT< a: DOUBLE, b: ARRAY<STRUCT< c: BOOLEAN > > >')
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_transform_batches_documents_into_parts(tmp_path, s3_client,
+                                                workers):
+    source_dir = tmp_path / 'source'
+    source_dir.mkdir()
+    for idx in range(40):
+        (source_dir / 'doc-{:02d}.json'.format(idx)).write_text(
+            '{{"id": {}, "tags": ["t{}"], "meta": {{}}}}'.format(idx, idx))
+
+    transform(str(source_dir), str(tmp_path / 'dest'), SCHEMA, s3_client,
+              'datalake', 'base', workers=workers, output_format='parquet',
+              max_records=25)
+
+    keys = sorted(item['Key'] for item in s3_client.list_objects_v2(
+        Bucket='datalake', Prefix='base/')['Contents'])
+    assert [key.rsplit('-', 1)[1] for key in keys] == [
+        '00000.parquet', '00001.parquet']
+    tables = [pyarrow.parquet.read_table(str(
+        tmp_path / 'dest' / key.split('/', 1)[1])) for key in keys]
+    assert [table.num_rows for table in tables] == [25, 15]
+    rows = sorted(row['id'] for table in tables for row in table.to_pylist())
+    assert rows == list(range(40))
@@ -0,0 +1,53 @@
+from shared import (
+    generate_partition_statements,
+    get_date_partition_projection,
+    get_date_partitions,
+    get_partition_path
+)
+import datetime
+import pytest
+
+
+def test_get_partition_path():
+    partitions = get_date_partitions('who', datetime.date(2021, 3, 7))
+
+    assert get_partition_path(partitions) == \
+        'source=who/year=2021/month=03/day=07'
+    assert get_partition_path([]) == ''
+
+
+def test_generate_partition_statements():
+    partitions = [('source', {'type': 'enum', 'values': 'who'})] + \
+        get_date_partition_projection(2019, 2030)
+
+    partitioned_by, properties = generate_partition_statements(
+        partitions, 's3://bucket/base/')
+
+    assert partitioned_by == ('\nPARTITIONED BY (\n source STRING,\n'
+                              ' year STRING,\n month STRING,\n'
+                              ' day STRING\n)')
+    assert properties == [
+        ('projection.enabled', 'true'),
+        ('projection.source.type', 'enum'),
+        ('projection.source.values', 'who'),
+        ('projection.year.type', 'integer'),
+        ('projection.year.range', '2019,2030'),
+        ('projection.month.type', 'integer'),
+        ('projection.month.range', '1,12'),
+        ('projection.month.digits', '2'),
+        ('projection.day.type', 'integer'),
+        ('projection.day.range', '1,31'),
+        ('projection.day.digits', '2'),
+        ('storage.location.template',
+         's3://bucket/base/source=${source}/year=${year}/month=${month}'
+         '/day=${day}'),
+    ]
+    assert generate_partition_statements([], 's3://bucket/base/') == \
+        ('', [])
+
+
+def test_date_partition_projection_years():
+    assert get_date_partition_projection(2018)[0] == (
+        'year', {'type': 'integer', 'range': '2018,2099'})
+    with pytest.raises(ValueError):
+        get_date_partition_projection(2030, 2020)
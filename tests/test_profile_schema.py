@@ -0,0 +1,93 @@
+from json_standardize import profile_schema, get_transformation_possibilities
+from shared import ijson_parse, json_dumps
+import random
+import pytest
+
+
+def reference_possibilities(fpath):
+    """ The get_transformation_possibilities profile_schema replaced,
+    which only understood plain type lists
+
+    """
+    transformation_required_prefixes = []
+
+    with open(fpath, 'rb') as fd:
+        running_prefix, found_object, found_string = None, False, False
+        for prefix, event, value in ijson_parse(fd):
+            if running_prefix:
+                if prefix == '{}.xitem'.format(running_prefix
+                                               ) and value == 'object':
+                    found_object = True
+                elif prefix == '{}.xitem'.format(running_prefix
+                                                 ) and value == 'string':
+                    found_string = True
+                if event == 'end_array':
+                    if found_object and found_string:
+                        transformation_required_prefixes.append(
+                            running_prefix)
+                    (running_prefix, found_object, found_string) = (
+                        None, False, False)
+                continue
+            if event == 'start_array' and prefix.endswith('type'):
+                running_prefix = prefix
+
+    return transformation_required_prefixes
+
+
+NAMES = ['a', 'b', 'note', 'type', 'items']
+TYPES = [['string'], ['object'], ['object', 'string'],
+         ['null', 'object', 'string'], ['integer', 'string'],
+         ['array', 'object', 'string']]
+
+
+def make_node(rng, depth):
+    types = rng.choice(TYPES[:2] if depth > 4 else TYPES)
+    node = {'type': types[0] if len(types) == 1 else types}
+    if 'object' in types:
+        node['properties'] = {
+            name: make_node(rng, depth + 1)
+            for name in rng.sample(NAMES, rng.randint(0, 3))}
+    if 'array' in types or rng.random() < 0.2 and depth < 4:
+        if 'array' not in types:
+            node = {'type': 'array'}
+        node['xitems'] = make_node(rng, depth + 1)
+    return node
+
+
+@pytest.mark.parametrize('seed', range(100))
+def test_matches_the_previous_possibilities(seed, tmp_path):
+    rng = random.Random(seed)
+    schema = {'type': 'object', 'properties': {
+        name: make_node(rng, 0) for name in NAMES}}
+    fpath = str(tmp_path / 'schema.json')
+    with open(fpath, 'wb') as fp:
+        fp.write(json_dumps(schema))
+
+    expected = reference_possibilities(fpath)
+
+    assert profile_schema(fpath).mixed_prefixes == expected
+    assert get_transformation_possibilities(schema) == expected
+
+
+def test_profiles_anyof_and_nested_arrays():
+    schema = {'type': 'object', 'properties': {
+        'note': {'anyOf': [
+            {'type': 'string'},
+            {'type': 'object', 'properties': {'id': {'type': 'integer'}}},
+        ]},
+        'grid': {'type': 'array', 'xitems': {'type': 'array', 'xitems': {
+            'type': ['object', 'string'], 'properties': {}}}},
+        'count': {'type': ['integer', 'null']},
+    }}
+
+    profile = profile_schema(schema)
+
+    assert profile.mixed_prefixes == [
+        'properties.note.type',
+        'properties.grid.xitems.xitems.type']
+    assert profile.unions == {
+        'properties.note': ['object', 'string'],
+        'properties.grid.xitems.xitems': ['object', 'string'],
+        'properties.count': ['integer', 'null'],
+    }
+    assert profile.max_depth == 3
@@ -0,0 +1,38 @@
+from json_standardize import transform
+import os
+
+
+SCHEMA = {'type': 'object', 'properties': {'id': {'type': 'integer'}}}
+
+
+def run(tmp_path, s3_client, **kwargs):
+    source_dir = tmp_path / 'source'
+    source_dir.mkdir(exist_ok=True)
+    for idx in range(4):
+        (source_dir / 'doc-{}.json'.format(idx)).write_text(
+            '{{"id": {}}}'.format(idx))
+    dest_dir = str(tmp_path / 'dest')
+    transform(str(source_dir), dest_dir, SCHEMA, s3_client, 'datalake',
+              'base', profile='cpu', **kwargs)
+    return sorted(os.listdir('{}.profile'.format(dest_dir)))
+
+
+def test_profiles_the_whole_run_once(tmp_path, s3_client, monkeypatch):
+    monkeypatch.delenv('DATALAKE_PROFILE_EVERY', raising=False)
+    monkeypatch.delenv('DATALAKE_PROFILE_DIR', raising=False)
+
+    reports = run(tmp_path, s3_client)
+
+    assert len(reports) == 1
+    assert reports[0].startswith('transform-')
+
+
+def test_profiles_sampled_files_only(tmp_path, s3_client, monkeypatch):
+    monkeypatch.delenv('DATALAKE_PROFILE_DIR', raising=False)
+
+    reports = run(tmp_path, s3_client, profile_every=2)
+
+    # Files go in directory order, every other one being profiled
+    assert [report[:16] for report in reports] == [
+        'transform-00000-', 'transform-00002-']
+    assert all(report.endswith('.json.pstats') for report in reports)
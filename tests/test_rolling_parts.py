@@ -0,0 +1,102 @@
+from json_standardize import transform
+from shared import RollingJsonLinesWriter
+import gzip
+import os
+
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'id': {'type': 'integer'},
+    },
+}
+
+
+MIXED_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'note': {'type': ['object', 'string']},
+    },
+}
+
+
+def write_documents(source_dir, total, document='{{"id": {}}}'):
+    os.makedirs(source_dir, exist_ok=True)
+    for fname in os.listdir(source_dir):
+        os.remove(os.path.join(source_dir, fname))
+    for idx in range(total):
+        with open(os.path.join(source_dir, 'doc-{:02d}.json'.format(
+                idx)), 'w') as fp:
+            fp.write(document.format(idx))
+
+
+def list_keys(s3_client, prefix):
+    resp = s3_client.list_objects_v2(Bucket='datalake', Prefix=prefix)
+    return sorted(item['Key'] for item in resp.get('Contents', []))
+
+
+def test_rolls_over_parts(tmp_path):
+    closed = []
+    writer = RollingJsonLinesWriter(
+        str(tmp_path), max_records=2, compression='gzip',
+        on_close=lambda part_path, sources: closed.append(
+            (os.path.basename(part_path), sources)))
+    for idx in range(5):
+        writer.write('{{"id": {}}}'.format(idx).encode('utf-8'), idx + 1)
+    writer.close()
+
+    assert closed == [('part-00000.jsonl.gz', [1, 2]),
+                      ('part-00001.jsonl.gz', [3, 4]),
+                      ('part-00002.jsonl.gz', [5])]
+    with gzip.open(str(tmp_path / 'part-00001.jsonl.gz')) as fp:
+        assert fp.read() == b'{"id": 2}\n{"id": 3}\n'
+
+
+def test_reruns_replace_the_parts_of_previous_runs(tmp_path, s3_client):
+    source_dir = str(tmp_path / 'source')
+    dest_dir = str(tmp_path / 'dest')
+    partitions = [('year', '2018'), ('month', '05')]
+    s3_client.put_object(Bucket='datalake', Key='base/year=2018/other.json',
+                         Body=b'{}')
+
+    write_documents(source_dir, 40)
+    transform(source_dir, dest_dir, SCHEMA, s3_client, 'datalake', 'base',
+              compact=True, max_records=10, partitions=partitions)
+    assert len(list_keys(s3_client, 'base/year=2018/month=05/')) == 4
+
+    write_documents(source_dir, 15)
+    transform(source_dir, dest_dir, SCHEMA, s3_client, 'datalake', 'base',
+              compact=True, max_records=10, partitions=partitions)
+
+    keys = list_keys(s3_client, 'base/')
+    assert keys == ['base/year=2018/month=05/part-00000.jsonl',
+                    'base/year=2018/month=05/part-00001.jsonl',
+                    'base/year=2018/other.json']
+    records = b''.join(s3_client.get_object(
+        Bucket='datalake', Key=key)['Body'].read() for key in keys[:2])
+    assert len(records.splitlines()) == 15
+
+
+def test_failed_or_empty_runs_keep_the_previous_parts(tmp_path, s3_client):
+    source_dir = str(tmp_path / 'source')
+    dest_dir = str(tmp_path / 'dest')
+
+    def run():
+        transform(source_dir, dest_dir, MIXED_SCHEMA, s3_client, 'datalake',
+                  'base', compact=True, max_records=10)
+
+    write_documents(source_dir, 30, '{{"note": "note {}"}}')
+    run()
+    previous = list_keys(s3_client, 'base/')
+    assert len(previous) == 3
+
+    # One file fails, the parts written then do not replace all others
+    write_documents(source_dir, 5, '{{"note": "note {}"}}')
+    with open(os.path.join(source_dir, 'doc-00.json'), 'w') as fp:
+        fp.write('{"note": ""}')
+    run()
+    assert list_keys(s3_client, 'base/') == previous
+
+    write_documents(source_dir, 0)
+    run()
+    assert list_keys(s3_client, 'base/') == previous
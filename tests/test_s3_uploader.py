@@ -0,0 +1,87 @@
+from json_standardize import transform
+from shared import S3Uploader, Metrics
+import rapidjson
+import pytest
+import os
+
+
+SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'id': {'type': 'integer'},
+        'name': {'type': 'string'},
+    },
+}
+
+
+def write_documents(source_dir, total):
+    os.makedirs(source_dir)
+    for idx in range(total):
+        with open(os.path.join(source_dir, 'doc-{:02d}.json'.format(
+                idx)), 'w') as fp:
+            rapidjson.dump({'id': idx, 'name': 'doc {}'.format(idx)}, fp)
+
+
+def test_uploads_and_reports_etags(tmp_path, s3_client):
+    fpath = tmp_path / 'doc.json'
+    fpath.write_text('{"id": 1}')
+    completed = []
+    metrics = Metrics()
+
+    with S3Uploader('datalake', s3_client=s3_client,
+                    metrics=metrics) as uploader:
+        uploader.submit(str(fpath), 'base/doc.json',
+                        lambda s3_key, etag: completed.append(
+                            (s3_key, etag)))
+
+    body = s3_client.get_object(Bucket='datalake', Key='base/doc.json')
+    assert body['Body'].read() == b'{"id": 1}'
+    assert completed == [('base/doc.json', body['ETag'])]
+    assert uploader.uploaded == 1
+    assert not uploader.failures
+    assert metrics.summary()['counters']['uploaded_bytes'] == 9
+    uploader.raise_for_failures()
+
+
+def test_records_failed_uploads(tmp_path, s3_client):
+    fpath = tmp_path / 'doc.json'
+    fpath.write_text('{"id": 1}')
+    completed = []
+
+    with S3Uploader('missing-bucket', s3_client=s3_client) as uploader:
+        uploader.submit(str(fpath), 'base/doc.json',
+                        lambda s3_key, etag: completed.append(s3_key))
+
+    assert uploader.failed == 1
+    assert [failure[:2] for failure in uploader.failures] == [
+        (str(fpath), 'base/doc.json')]
+    assert not completed
+    with pytest.raises(RuntimeError):
+        uploader.raise_for_failures()
+
+
+def test_transform_uploads_every_file(tmp_path, s3_client):
+    source_dir = str(tmp_path / 'source')
+    write_documents(source_dir, 40)
+
+    transform(source_dir, str(tmp_path / 'dest'), SCHEMA, s3_client,
+              'datalake', 'base', upload_workers=4)
+
+    keys = [item['Key'] for item in s3_client.list_objects_v2(
+        Bucket='datalake', Prefix='base/')['Contents']]
+    assert len(keys) == 40
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_transform_fails_when_uploads_fail(tmp_path, s3_client, caplog,
+                                           compact):
+    source_dir = str(tmp_path / 'source')
+    write_documents(source_dir, 40)
+
+    with pytest.raises(RuntimeError):
+        transform(source_dir, str(tmp_path / 'dest'), SCHEMA, s3_client,
+                  'missing-bucket', 'base', upload_workers=4,
+                  compact=compact)
+
+    assert 'Success: 0' in caplog.text
+    assert 'Failed: 40' in caplog.text
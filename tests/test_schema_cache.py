@@ -0,0 +1,53 @@
+from shared import infer_schema_from_files, infer_schema, read_json
+import shared
+import os
+
+
+def write_documents(source_dir):
+    documents = ['{"a": 1, "b": ["x"]}', '{"a": "one", "c": {"d": null}}']
+    fpaths = []
+    for idx, document in enumerate(documents):
+        fpath = os.path.join(source_dir, 'doc-{}.json'.format(idx))
+        with open(fpath, 'w') as fp:
+            fp.write(document)
+        fpaths.append(fpath)
+    return fpaths
+
+
+def test_second_inference_hits_the_cache(tmp_path, monkeypatch):
+    fpaths = write_documents(str(tmp_path))
+    cache_dir = str(tmp_path / 'cache')
+    expected = infer_schema(read_json(fpath) for fpath in fpaths)
+
+    assert infer_schema_from_files(fpaths, cache_dir) == expected
+
+    inferred = []
+
+    def counting_infer_schema(documents):
+        inferred.append(documents)
+        return infer_schema(documents)
+
+    monkeypatch.setattr(shared, 'infer_schema', counting_infer_schema)
+
+    assert infer_schema_from_files(fpaths, cache_dir) == expected
+    assert shared._cached_file_schema.cache_info().hits >= len(fpaths)
+    assert not inferred
+
+    # Another process only shares the on-disk cache
+    shared._cached_file_schema.cache_clear()
+    assert infer_schema_from_files(fpaths, cache_dir) == expected
+    assert not inferred
+
+
+def test_changed_files_are_inferred_again(tmp_path):
+    fpaths = write_documents(str(tmp_path))
+    cache_dir = str(tmp_path / 'cache')
+    infer_schema_from_files(fpaths, cache_dir)
+
+    with open(fpaths[0], 'w') as fp:
+        fp.write('{"e": true}')
+    os.utime(fpaths[0], ns=(0, 0))
+
+    schema = infer_schema_from_files(fpaths, cache_dir)
+    assert 'e' in schema['properties']
+    assert 'b' not in schema['properties']
@@ -0,0 +1,122 @@
+from json_standardize import (
+    stream_transform_document,
+    stream_standardize_document,
+    standardize_document,
+    transform_document,
+    metrics
+)
+from shared import json_dumps
+from decimal import Decimal
+import random
+import pytest
+import json
+import io
+import os
+
+
+KEYS = ['a', 'b', 'name', 'text', 'é', 'q"uote']
+
+
+def make_value(rng, depth):
+    kind = rng.choice(['string', 'string', 'object', 'array', 'scalar'] if
+                      depth < 4 else ['string', 'scalar'])
+    if kind == 'string':
+        return rng.choice(['', 'alpha', 'bravo\n"x"', 'ünïcode', '\x01'])
+    if kind == 'object':
+        return {rng.choice(KEYS): make_value(rng, depth + 1)
+                for _ in range(rng.randint(0, 3))}
+    if kind == 'array':
+        return [make_value(rng, depth + 1)
+                for _ in range(rng.randint(0, 3))]
+    return rng.choice([0, -7, 2 ** 70, 1.5, Decimal('0.10'),
+                       Decimal('1E+400'), True, False, None])
+
+
+def string_prefixes(value, prefix=''):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from string_prefixes(
+                item, '{}.{}'.format(prefix, key) if prefix else key)
+    elif isinstance(value, list):
+        for item in value:
+            yield from string_prefixes(
+                item, '{}.xitem'.format(prefix) if prefix else 'xitem')
+    elif isinstance(value, str):
+        yield prefix
+
+
+def parse(data):
+    return json.loads(data, parse_float=Decimal)
+
+
+@pytest.mark.parametrize('seed', range(200))
+def test_stream_matches_built_document(seed):
+    rng = random.Random(seed)
+    document = {key: make_value(rng, 0) for key in KEYS[:rng.randint(1, 4)]}
+    prefixes = sorted(set(string_prefixes(document)))
+    target_prefixes = frozenset(
+        prefix for prefix in prefixes if rng.random() < 0.5)
+    data = json_dumps(document)
+
+    built, built_found, built_processed = standardize_document(
+        io.BytesIO(data), target_prefixes)
+    out_fp = io.BytesIO()
+    found, processed = stream_standardize_document(
+        io.BytesIO(data), target_prefixes, out_fp, flush_size=16)
+
+    assert parse(out_fp.getvalue()) == built
+    assert (found, processed) == (built_found, built_processed)
+
+
+def test_stream_transform_document(tmp_path):
+    schema_prefixes = ['properties.notes.xitems.type']
+    fpath = str(tmp_path / 'doc.json')
+    with open(fpath, 'w') as fp:
+        fp.write('{"notes": ["first", {"text": ["second"]}], "n": 1.10}')
+    fpath_transformed = str(tmp_path / 'out' / 'doc.json')
+    os.makedirs(os.path.dirname(fpath_transformed))
+
+    assert stream_transform_document(fpath, fpath_transformed,
+                                     schema_prefixes)
+
+    with open(fpath_transformed, 'rb') as fp:
+        streamed = fp.read()
+    assert streamed == b'{"notes":[{"text":["first"]},{"text":["second"]}]' \
+        b',"n":1.10}'
+    assert parse(streamed) == transform_document(fpath, schema_prefixes)
+    assert os.listdir(os.path.dirname(fpath_transformed)) == ['doc.json']
+
+
+def test_stream_transform_document_drops_failed_output(tmp_path):
+    fpath = str(tmp_path / 'doc.json')
+    with open(fpath, 'w') as fp:
+        fp.write('{"notes": ["", "kept"]}')
+    fpath_transformed = str(tmp_path / 'doc.out.json')
+
+    assert not stream_transform_document(
+        fpath, fpath_transformed, ['properties.notes.xitems.type'])
+    assert transform_document(
+        fpath, ['properties.notes.xitems.type']) is None
+    assert os.listdir(str(tmp_path)) == ['doc.json']
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_parse_and_rewrite_are_timed_apart(tmp_path, streaming):
+    fpath = str(tmp_path / 'doc.json')
+    with open(fpath, 'w') as fp:
+        fp.write(json.dumps({'notes': ['note'] * 5000}))
+    metrics.reset()
+    metrics.observe('schema_inference', 1.0)
+
+    if streaming:
+        assert stream_transform_document(
+            fpath, str(tmp_path / 'out.json'),
+            ['properties.notes.xitems.type'])
+    else:
+        assert transform_document(fpath, ['properties.notes.xitems.type'])
+
+    samples = metrics.summary()['samples']
+    assert samples['parse']['count'] == samples['rewrite']['count'] == 1
+    assert samples['parse']['total'] > 0
+    assert samples['rewrite']['total'] > 0
+    assert samples['schema_inference']['count'] == 1